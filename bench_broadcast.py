@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+bench_broadcast.py — offline benchmark for the broadcast fan-out.
+
+Runs the real broadcast path from main.py (job creation, dispatcher, rate limiters,
+delivery log, SQLite writer) against a simulated Telegram bot, with no network.
+
+    python bench_broadcast.py --chats 100 1000 10000 50000
+    python bench_broadcast.py --chats 5000 --rate 28 --latency 80 --flood-rate 0.001
+    python bench_broadcast.py --chats 1000 --mode text      # goes through /broadcast
+    python bench_broadcast.py --explain                     # fail if a report query scans a table
+
+Every chat count runs in a fresh subprocess with its own temporary DB, so peak memory
+(max RSS) and DB write volume are per scenario. --rate defaults to effectively
+unlimited so the numbers show engine overhead; pass --rate 28 for Telegram's quota.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import logging
+import resource
+import tempfile
+import subprocess
+from types import SimpleNamespace
+
+from telegram import MessageId
+from telegram.error import Forbidden, RetryAfter
+
+class FakeBot:
+    """Stands in for telegram.Bot: sleeps for a simulated latency, then succeeds,
+    raises RetryAfter (flood wait) or raises Forbidden (permanent failure)."""
+
+    def __init__(self, latency: float, jitter: float, flood_rate: float, flood_wait: int, fail_rate: float, seed: int):
+        self.latency = latency
+        self.jitter = jitter
+        self.flood_rate = flood_rate
+        self.flood_wait = flood_wait
+        self.fail_rate = fail_rate
+        self.rng = random.Random(seed)
+        self.calls = 0
+        self.done_at = {}  # chat_id -> time its final (sent / permanently failed) call returned
+        self._next_id = 0
+
+    async def _call(self, chat_id: int):
+        self.calls += 1
+        await asyncio.sleep(max(0.0, self.rng.gauss(self.latency, self.jitter)))
+        roll = self.rng.random()
+        if roll < self.flood_rate:
+            raise RetryAfter(self.flood_wait)
+        self.done_at[chat_id] = time.perf_counter()
+        if roll < self.flood_rate + self.fail_rate:
+            raise Forbidden("Forbidden: bot was kicked from the group chat")
+        self._next_id += 1
+        return MessageId(self._next_id)
+
+    async def copy_message(self, chat_id, from_chat_id, message_id, **kwargs):
+        return await self._call(chat_id)
+
+    async def send_message(self, chat_id, text, **kwargs):
+        return await self._call(chat_id)
+
+    async def get_chat_administrators(self, chat_id, **kwargs):
+        await asyncio.sleep(self.latency)
+        return [object()]
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+def db_size(path: str) -> int:
+    return sum(os.path.getsize(p) for p in (path, path + "-wal") if os.path.exists(p))
+
+async def run_scenario(main, args) -> dict:
+    bot = FakeBot(args.latency / 1000, args.jitter / 1000, args.flood_rate, args.flood_wait, args.fail_rate, args.seed)
+    chats = [(-1000000000000 - i, "supergroup", f"bench {i}", "", None, main.now_iso()) for i in range(args.chats)]
+    main.db_write(lambda conn: conn.executemany(
+        "INSERT INTO chats (chat_id, type, title, username, added_by, added_at) VALUES (?, ?, ?, ?, ?, ?)", chats))
+    main.chat_registry.load()
+    main.spawn(main.scheduler.run())
+    main.spawn(main.dispatcher.run(bot))
+    await asyncio.sleep(0)
+
+    source = SimpleNamespace(chat_id=-1001, message_id=1, text="benchmark post", caption=None, from_user=None,
+                             photo=None, video=None, document=None, audio=None, voice=None, sticker=None)
+    size_before = db_size(main.DB_PATH)
+    txns_before = main.DB_WRITE_LATENCY.count()
+    started = time.perf_counter()
+    if args.mode == "text":
+        replies = []
+
+        async def edit_text(text, **kwargs):
+            replies.append(text)
+
+        async def reply_text(text, **kwargs):
+            replies.append(text)
+            return SimpleNamespace(text=text, edit_text=edit_text)
+
+        update = SimpleNamespace(effective_user=SimpleNamespace(id=main.MAIN_ADMIN_ID),
+                                 message=SimpleNamespace(reply_text=reply_text, **vars(source)))
+        await main.broadcast_cmd(update, SimpleNamespace(bot=bot, args=["benchmark", "post"]))
+        while not replies[-1].startswith("Broadcast #"):  # progress edits until the final summary
+            await asyncio.sleep(0.01)
+        summary = {"sent": None, "failed": None, "reply": replies[-1] if replies else ""}
+    else:
+        summary = await main.broadcast_message_to_all(source, SimpleNamespace(bot=bot))
+    elapsed = time.perf_counter() - started
+
+    completions = [t - started for t in bot.done_at.values()]
+    return {
+        "chats": args.chats,
+        "mode": args.mode,
+        "seconds": round(elapsed, 3),
+        "throughput": round(args.chats / elapsed, 1) if elapsed else 0.0,
+        "p50": round(percentile(completions, 50), 3),
+        "p99": round(percentile(completions, 99), 3),
+        "api_calls": bot.calls,
+        "sent": summary.get("sent"),
+        "failed": summary.get("failed"),
+        "db_txns": main.DB_WRITE_LATENCY.count() - txns_before,
+        "db_bytes": db_size(main.DB_PATH) - size_before,
+        "report_ms": round(time_reports(main) * 1000, 2),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+def time_reports(main) -> float:
+    """Slowest of the indexed admin lookups against the DB the scenario just filled."""
+    job_id = main.db_read_one("SELECT MAX(id) FROM messages")[0]
+    day = main.today_str()
+    worst = 0.0
+    for sql, params in main.INDEXED_QUERIES.values():
+        if params and params[0] == 0:  # job id placeholder
+            params = (job_id,) + params[1:]
+        if "msg_date" in sql:
+            params = (day + "T00:00:00", day + "T23:59:59")
+        elif "day BETWEEN" in sql:
+            params = (day, day)
+        started = time.perf_counter()
+        main.db_read(sql, params)
+        worst = max(worst, time.perf_counter() - started)
+    return worst
+
+def check_plans(main) -> int:
+    failures = 0
+    for name, steps in main.explain_queries().items():
+        scans = [s for s in steps if s.startswith("SCAN")]
+        failures += bool(scans)
+        print(f"{'FAIL' if scans else 'ok':>4}  {name}: {'; '.join(steps)}")
+    return failures
+
+def run_single(args):
+    with tempfile.TemporaryDirectory(prefix="bench-broadcast-") as tmp:
+        os.environ["DB_PATH"] = os.path.join(tmp, "bench.db")
+        os.environ["JSON_PATH"] = os.path.join(tmp, "data.json")
+        os.environ["GLOBAL_RATE_LIMIT"] = str(args.rate)
+        os.environ["MAX_CONCURRENT_SENDS"] = str(args.concurrency)
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        import main  # reads its config from the environment set above
+
+        logging.getLogger().setLevel(logging.WARNING)
+        main.init_db()
+        if args.explain:
+            failures = check_plans(main)
+            main.close_db()
+            raise SystemExit(1 if failures else 0)
+        result = asyncio.run(run_scenario(main, args))
+        main.close_db()
+    print(json.dumps(result))
+
+COLUMNS = ("chats", "mode", "seconds", "throughput", "p50", "p99", "api_calls", "db_txns", "db_bytes", "report_ms", "peak_rss_mb")
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chats", type=int, nargs="+", default=[100, 1000, 5000])
+    parser.add_argument("--mode", choices=("copy", "text"), default="copy", help="channel-post copy or /broadcast text")
+    parser.add_argument("--latency", type=float, default=50.0, help="mean simulated API latency (ms)")
+    parser.add_argument("--jitter", type=float, default=15.0, help="latency standard deviation (ms)")
+    parser.add_argument("--flood-rate", type=float, default=0.0, help="probability a call gets a 429")
+    parser.add_argument("--flood-wait", type=int, default=1, help="retry_after of injected 429s (s)")
+    parser.add_argument("--fail-rate", type=float, default=0.01, help="probability of a permanent failure")
+    parser.add_argument("--rate", type=float, default=1e6, help="GLOBAL_RATE_LIMIT for the run (msg/s)")
+    parser.add_argument("--concurrency", type=int, default=20, help="MAX_CONCURRENT_SENDS for the run")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help="print one JSON object per scenario")
+    parser.add_argument("--explain", action="store_true", help="check report query plans for table scans and exit")
+    args = parser.parse_args()
+
+    if args.explain:
+        return run_single(args)
+
+    if os.environ.get("BENCH_CHILD"):
+        args.chats = int(os.environ["BENCH_CHILD"])
+        return run_single(args)
+
+    if not args.json:
+        print("  ".join(f"{c:>11}" for c in COLUMNS))
+    for n in args.chats:
+        out = subprocess.run([sys.executable, os.path.abspath(__file__)] + sys.argv[1:], capture_output=True, text=True,
+                             env=dict(os.environ, BENCH_CHILD=str(n)))
+        if out.returncode != 0:
+            sys.stderr.write(out.stderr)
+            raise SystemExit(out.returncode)
+        result = json.loads(out.stdout.strip().splitlines()[-1])
+        if args.json:
+            print(json.dumps(result))
+        else:
+            print("  ".join(f"{result[c]!s:>11}" for c in COLUMNS))
+
+if __name__ == "__main__":
+    main_cli()
@@ -17,22 +17,42 @@ Features implemented (1..16 from your list):
 - Bot status command
 - Track which groups failed to receive messages
 - Track groups where bot was removed
-- Persistent data saved in SQLite (bot_data.db) + data.json
+- Persistent data saved in SQLite (bot_data.db); /export dumps the legacy data.json
 - Channel automatic SMS forward + logging
 """
 
+import io
 import os
 import sqlite3
 import asyncio
 import logging
 import json
-from datetime import datetime
-from typing import Optional, List
+import re
+import gzip
+import hmac
+import time
+import queue
+import random
+import atexit
+import signal
+import secrets
+import threading
+from collections import OrderedDict, deque, namedtuple
+from concurrent.futures import Future
+from contextvars import ContextVar
+from datetime import datetime, timedelta
+from typing import Dict, Optional, List
 from threading import Thread
 
-from telegram import Update, ChatMember, Message
+from telegram import (Update, ChatMember, Message, MessageEntity, InputMediaAudio, InputMediaDocument,
+                      InputMediaPhoto, InputMediaVideo)
+from telegram.error import BadRequest, ChatMigrated, Forbidden, NetworkError, RetryAfter, TelegramError
+from tornado.web import Application as WebApplication, RequestHandler
 from telegram.ext import (
+    Application,
     ApplicationBuilder,
+    BaseRateLimiter,
+    BaseUpdateProcessor,
     ContextTypes,
     CommandHandler,
     MessageHandler,
@@ -46,9 +66,50 @@ BOT_TOKEN = "8414051726:AAF6vcdJu2KSs67VBlZqj1F7QeNoPFzCMPc"
 MAIN_ADMIN_ID = 7149740820
 
 DB_PATH = os.getenv("DB_PATH", "bot_data.db")
-JSON_PATH = os.getenv("JSON_PATH", "data.json")
-SEND_DELAY = float(os.getenv("SEND_DELAY", "0.6"))  # seconds between sends to avoid rate limits
+JSON_PATH = os.getenv("JSON_PATH", "data.json")  # legacy log; imported once at startup, produced by /export
+DB_CACHE_KB = int(os.getenv("DB_CACHE_KB", "16384"))  # SQLite page cache per connection
+# >0: every N seconds is_admin() checks whether another process changed the admins table
+ADMIN_CACHE_RECHECK = float(os.getenv("ADMIN_CACHE_RECHECK", "0"))
+DELIVERY_FLUSH_ROWS = int(os.getenv("DELIVERY_FLUSH_ROWS", "500"))  # flush delivery log after N rows...
+DELIVERY_FLUSH_MS = int(os.getenv("DELIVERY_FLUSH_MS", "1000"))  # ...or after T ms, whichever comes first
+# A clean stop drains in-flight sends and flushes the buffer. A crash loses up to one buffer
+# (N rows or T ms of sends), and the resumed job sends those targets a second time.
+SHUTDOWN_DRAIN_SECONDS = float(os.getenv("SHUTDOWN_DRAIN_SECONDS", "10"))  # max wait for in-flight sends on stop
+# Per-target delivery rows of finished broadcasts older than this many days are archived to
+# ARCHIVE_DIR/<day>/deliveries-<id>.jsonl.gz and deleted from the DB (0 keeps them forever).
+# Counters and error tallies stay in the aggregate tables.
+DELIVERY_RETENTION_DAYS = int(os.getenv("DELIVERY_RETENTION_DAYS", "30"))
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", os.path.join(os.path.dirname(DB_PATH) or ".", "archive"))
+RETENTION_INTERVAL = int(os.getenv("RETENTION_INTERVAL", "21600"))  # seconds between retention passes
+VACUUM_STEP_PAGES = int(os.getenv("VACUUM_STEP_PAGES", "1000"))  # free pages returned per incremental vacuum step
+# Fan-out pacing: a global token bucket (Telegram allows ~30 msg/s per bot) plus a per-chat spacing
+# (groups allow ~20 msg/min), with at most MAX_CONCURRENT_SENDS requests in flight.
+GLOBAL_RATE_LIMIT = float(os.getenv("GLOBAL_RATE_LIMIT", "28"))  # messages per second across all chats
+PER_CHAT_INTERVAL = float(os.getenv("PER_CHAT_INTERVAL", "3.0"))  # min seconds between sends to one chat
+MAX_CONCURRENT_SENDS = int(os.getenv("MAX_CONCURRENT_SENDS", "20"))
+PROGRESS_EDIT_INTERVAL = float(os.getenv("PROGRESS_EDIT_INTERVAL", "5"))  # min seconds between progress edits
+ALBUM_COLLECT_SECONDS = float(os.getenv("ALBUM_COLLECT_SECONDS", "1.5"))  # quiet time before an album is complete
+# Updates handled at once; updates from the same chat still run one at a time, in order.
+MAX_CONCURRENT_UPDATES = int(os.getenv("MAX_CONCURRENT_UPDATES", "32"))
+MIN_RATE_LIMIT = float(os.getenv("MIN_RATE_LIMIT", "1"))  # floor for the adaptive rate after repeated 429s
+TRANSIENT_RETRIES = int(os.getenv("TRANSIENT_RETRIES", "3"))  # retries for timeouts / network errors
+MAX_FLOOD_REQUEUES = int(os.getenv("MAX_FLOOD_REQUEUES", "5"))  # times a target may be requeued after a 429
+# "polling" (default) or "webhook". In webhook mode updates are POSTed to WEBHOOK_PATH on the
+# same PORT that serves the health check; WEBHOOK_URL (public https base) is registered with
+# Telegram when set. Every POST must carry WEBHOOK_SECRET; when it is unset but WEBHOOK_URL is
+# set, a random one is generated at start and registered with the webhook. WEBHOOK_INSECURE=1
+# accepts unauthenticated POSTs, for local testing only.
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+PORT = int(os.getenv("PORT", "8080"))
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "").rstrip("/")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_INSECURE = os.getenv("WEBHOOK_INSECURE", "False").lower() in ("1", "true", "yes")
 CHECK_ADMIN_BEFORE_SEND = os.getenv("CHECK_ADMIN_BEFORE_SEND", "False").lower() in ("1", "true", "yes")
+# consecutive "chat is gone" delivery errors before a chat is marked inactive (0 = never)
+DEAD_CHAT_THRESHOLD = int(os.getenv("DEAD_CHAT_THRESHOLD", "3"))
+ADMIN_CHECK_TTL = float(os.getenv("ADMIN_CHECK_TTL", "21600"))  # seconds a cached admin check stays fresh
+ADMIN_CHECK_CACHE_SIZE = int(os.getenv("ADMIN_CHECK_CACHE_SIZE", "100000"))
 
 if not BOT_TOKEN or MAIN_ADMIN_ID == 0:
     raise SystemExit("Please set BOT_TOKEN and MAIN_ADMIN_ID before running.")
@@ -56,202 +117,808 @@ if not BOT_TOKEN or MAIN_ADMIN_ID == 0:
 # ---------------- Logging ----------------
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 logger = logging.getLogger(__name__)
+logging.getLogger("tornado.access").setLevel(logging.WARNING)  # one line per webhook POST otherwise
+
+# ---------------- Metrics ----------------
+# Minimal Prometheus text-format metrics, served at /metrics by the web server.
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+        self._values = {}
+        self._lock = threading.Lock()  # observed from the DB writer thread too
+        METRICS.append(self)
+
+    @staticmethod
+    def _key(labels: dict) -> tuple:
+        return tuple(sorted(labels.items()))
+
+    @staticmethod
+    def _fmt(key: tuple, extra: tuple = ()) -> str:
+        pairs = key + extra
+        return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}" if pairs else ""
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            lines += [f"{self.name}{self._fmt(k)} {v}" for k, v in self._values.items()]
+        return lines
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, read=None):
+        super().__init__(name, help_text)
+        self._read = read  # optional callable sampled at scrape time
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        if self._read is not None:
+            self.set(self._read())
+        return super().render()
+
+class Histogram(_Metric):
+    kind = "histogram"
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900, 3600)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0] * len(self.BUCKETS) + [0, 0.0]  # buckets..., count, sum
+            for i, bound in enumerate(self.BUCKETS):
+                if value <= bound:
+                    counts[i] += 1
+            counts[-2] += 1
+            counts[-1] += value
+
+    def count(self, **labels) -> int:
+        with self._lock:
+            counts = self._values.get(self._key(labels))
+        return counts[-2] if counts else 0
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            for key, counts in self._values.items():
+                for bound, n in zip(self.BUCKETS, counts):
+                    lines.append(f"{self.name}_bucket{self._fmt(key, (('le', bound),))} {n}")
+                lines.append(f"{self.name}_bucket{self._fmt(key, (('le', '+Inf'),))} {counts[-2]}")
+                lines.append(f"{self.name}_count{self._fmt(key)} {counts[-2]}")
+                lines.append(f"{self.name}_sum{self._fmt(key)} {counts[-1]}")
+        return lines
+
+METRICS: List[_Metric] = []
+
+def render_metrics() -> str:
+    return "\n".join(line for m in METRICS for line in m.render()) + "\n"
+
+API_REQUESTS = Counter("telegram_api_requests_total", "Bot API calls by method and outcome")
+API_LATENCY = Histogram("telegram_api_latency_seconds", "Bot API call latency by method")
+FLOOD_WAITS = Counter("telegram_flood_waits_total", "429 RetryAfter responses")
+BROADCAST_DURATION = Histogram("broadcast_duration_seconds", "End-to-end broadcast job duration")
+BROADCAST_RATE = Gauge("broadcast_fanout_rate", "Deliveries per second of the last finished broadcast")
+DELIVERIES = Counter("broadcast_deliveries_total", "Delivery outcomes by status")
+QUEUE_DEPTH = Gauge("broadcast_queue_depth", "Targets waiting to be sent across running broadcasts")
+ADMIN_CHECK_CACHE = Counter("admin_check_cache_total", "CHECK_ADMIN_BEFORE_SEND cache lookups by result")
+DB_WRITE_LATENCY = Histogram("db_write_latency_seconds", "Time to run one DB writer transaction")
+ARCHIVED_DELIVERIES = Counter("archived_deliveries_total", "Delivery rows moved out of the DB by retention")
 
 # ---------------- Helpers ----------------
 def now_iso():
     return datetime.utcnow().isoformat()
 
-def init_db():
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("""CREATE TABLE IF NOT EXISTS admins (user_id INTEGER PRIMARY KEY, added_at TEXT)""")
-    cur.execute("""CREATE TABLE IF NOT EXISTS chats (
+# ---------------- SQLite access ----------------
+# One long-lived write connection owned by a writer thread, plus one long-lived read
+# connection per thread. WAL lets the readers run while the writer commits.
+def open_connection(path: str, readonly: bool = False) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA cache_size=-{DB_CACHE_KB}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA busy_timeout=5000")
+    if readonly:
+        conn.execute("PRAGMA query_only=ON")
+    return conn
+
+class DBWriter(Thread):
+    """Runs submitted `fn(conn, *args)` calls one at a time, each in its own transaction."""
+
+    def __init__(self, path: str):
+        super().__init__(name="db-writer", daemon=True)
+        self.path = path
+        self._jobs = queue.Queue()
+
+    def submit(self, fn, *args) -> Future:
+        fut = Future()
+        self._jobs.put((fn, args, fut))
+        return fut
+
+    def stop(self):
+        self._jobs.put(None)
+        self.join()
+
+    def run(self):
+        conn = open_connection(self.path)
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                break
+            fn, args, fut = job
+            if not fut.set_running_or_notify_cancel():
+                continue
+            started = time.perf_counter()
+            try:
+                with conn:
+                    result = fn(conn, *args)
+            except BaseException as e:
+                fut.set_exception(e)
+            else:
+                fut.set_result(result)
+            DB_WRITE_LATENCY.observe(time.perf_counter() - started)
+        conn.close()
+
+_db_writer: Optional[DBWriter] = None
+_read_local = threading.local()
+
+def start_db():
+    global _db_writer
+    if _db_writer is None:
+        _db_writer = DBWriter(DB_PATH)
+        _db_writer.start()
+        atexit.register(close_db)
+
+def close_db():
+    global _db_writer
+    if _db_writer is not None:
+        _db_writer.stop()
+        _db_writer = None
+
+def db_write(fn, *args):
+    """Run `fn(conn, *args)` on the writer thread and wait for its result."""
+    return _db_writer.submit(fn, *args).result()
+
+def db_execute(sql: str, params=()):
+    """Run one write statement; returns (rowcount, lastrowid)."""
+    def _run(conn):
+        cur = conn.execute(sql, params)
+        return cur.rowcount, cur.lastrowid
+    return db_write(_run)
+
+def read_conn() -> sqlite3.Connection:
+    conn = getattr(_read_local, "conn", None)
+    if conn is None:
+        conn = _read_local.conn = open_connection(DB_PATH, readonly=True)
+    return conn
+
+def db_read(sql: str, params=()) -> list:
+    return read_conn().execute(sql, params).fetchall()
+
+def db_read_one(sql: str, params=()):
+    return read_conn().execute(sql, params).fetchone()
+
+# Async access: writes await the writer thread's future, reads and other blocking work
+# run on the default executor so handlers never stall the event loop.
+async def adb_write(fn, *args):
+    return await asyncio.wrap_future(_db_writer.submit(fn, *args))
+
+async def adb_read(sql: str, params=()) -> list:
+    return await asyncio.to_thread(db_read, sql, params)
+
+async def adb_read_one(sql: str, params=()):
+    return await asyncio.to_thread(db_read_one, sql, params)
+
+async def run_blocking(fn, *args):
+    return await asyncio.to_thread(fn, *args)
+
+def _add_column(conn: sqlite3.Connection, table: str, column: str, decl: str):
+    if column not in {r[1] for r in conn.execute(f"PRAGMA table_info({table})")}:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+def _create_schema(conn: sqlite3.Connection):
+    conn.execute("""CREATE TABLE IF NOT EXISTS admins (user_id INTEGER PRIMARY KEY, added_at TEXT)""")
+    conn.execute("""CREATE TABLE IF NOT EXISTS chats (
         chat_id TEXT PRIMARY KEY, type TEXT, title TEXT, username TEXT, added_by INTEGER, added_at TEXT
     )""")
-    cur.execute("""CREATE TABLE IF NOT EXISTS messages (
+    conn.execute("""CREATE TABLE IF NOT EXISTS messages (
         id INTEGER PRIMARY KEY AUTOINCREMENT, msg_date TEXT, from_user INTEGER, from_chat_id TEXT,
         message_id INTEGER, content_type TEXT, text_preview TEXT, total_target INTEGER, total_sent INTEGER, total_failed INTEGER
     )""")
-    cur.execute("""CREATE TABLE IF NOT EXISTS deliveries (
+    conn.execute("""CREATE TABLE IF NOT EXISTS deliveries (
         id INTEGER PRIMARY KEY AUTOINCREMENT, message_row_id INTEGER, target_chat_id TEXT, status TEXT, error TEXT
     )""")
-    cur.execute("""CREATE TABLE IF NOT EXISTS left_chats (
+    conn.execute("""CREATE TABLE IF NOT EXISTS left_chats (
         chat_id TEXT PRIMARY KEY, title TEXT, removed_at TEXT
     )""")
-    cur.execute("INSERT OR IGNORE INTO admins (user_id, added_at) VALUES (?, ?)", (MAIN_ADMIN_ID, now_iso()))
-    conn.commit()
-    conn.close()
-
-# ---------------- JSON persistence for date-based logs ----------------
-def ensure_json():
-    if not os.path.exists(JSON_PATH):
-        data = {"groups_added_by_date": {}, "messages_by_date": {}, "admins": [], "left_chats": []}
-        with open(JSON_PATH, "w", encoding="utf-8") as f:
-            json.dump(data, f, indent=2, ensure_ascii=False)
+    _add_column(conn, "chats", "active", "INTEGER NOT NULL DEFAULT 1")
+    _add_column(conn, "chats", "fail_streak", "INTEGER NOT NULL DEFAULT 0")
+    conn.execute("""CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER)""")
+    conn.execute("""CREATE TABLE IF NOT EXISTS chat_events (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, day TEXT, kind TEXT, chat_id TEXT, title TEXT, at TEXT
+    )""")
+    conn.execute("""CREATE TABLE IF NOT EXISTS daily_stats (
+        day TEXT PRIMARY KEY, groups_added INTEGER NOT NULL DEFAULT 0, groups_left INTEGER NOT NULL DEFAULT 0,
+        sent INTEGER NOT NULL DEFAULT 0, failed INTEGER NOT NULL DEFAULT 0
+    )""")
+    conn.execute("""CREATE TABLE IF NOT EXISTS broadcast_jobs (
+        message_row_id INTEGER PRIMARY KEY, kind TEXT, from_chat_id TEXT, message_id INTEGER, text TEXT,
+        state TEXT, created_at TEXT, finished_at TEXT
+    )""")
+    if not conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'deliveries_job_target'").fetchone():
+        # (job, target) is the idempotency key; drop duplicates older versions may have written
+        conn.execute("""DELETE FROM deliveries WHERE id NOT IN
+                        (SELECT MIN(id) FROM deliveries GROUP BY message_row_id, target_chat_id)""")
+        conn.execute("CREATE UNIQUE INDEX deliveries_job_target ON deliveries (message_row_id, target_chat_id)")
+
+def _add_lookup_indexes(conn: sqlite3.Connection):
+    # /report filters on msg_date; job workers and /deliveries look up by job and status,
+    # and the index carries target_chat_id so the pending-target query never reads the table
+    conn.execute("CREATE INDEX IF NOT EXISTS messages_msg_date ON messages (msg_date)")
+    conn.execute("CREATE INDEX IF NOT EXISTS deliveries_job_status ON deliveries (message_row_id, status, target_chat_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS broadcast_jobs_state ON broadcast_jobs (state)")
+
+def _add_aggregates(conn: sqlite3.Connection):
+    # skipped deliveries get their own counters (they used to be counted as failed), and
+    # error classes are tallied per day and per message so reports never touch `deliveries`
+    _add_column(conn, "messages", "total_skipped", "INTEGER NOT NULL DEFAULT 0")
+    _add_column(conn, "daily_stats", "messages", "INTEGER NOT NULL DEFAULT 0")
+    _add_column(conn, "daily_stats", "skipped", "INTEGER NOT NULL DEFAULT 0")
+    conn.execute("""CREATE TABLE IF NOT EXISTS daily_errors (
+        day TEXT, error_class TEXT, count INTEGER NOT NULL DEFAULT 0, PRIMARY KEY (day, error_class)
+    ) WITHOUT ROWID""")
+    conn.execute("""CREATE TABLE IF NOT EXISTS message_errors (
+        message_row_id INTEGER, error_class TEXT, count INTEGER NOT NULL DEFAULT 0, PRIMARY KEY (message_row_id, error_class)
+    ) WITHOUT ROWID""")
+    conn.execute("""UPDATE messages SET total_skipped = (SELECT COUNT(*) FROM deliveries
+                    WHERE deliveries.message_row_id = messages.id AND deliveries.status = 'skipped')""")
+    conn.execute("UPDATE messages SET total_failed = MAX(total_failed - total_skipped, 0)")
+    for day, count, skipped in conn.execute("""SELECT substr(msg_date, 1, 10), COUNT(*), SUM(total_skipped)
+                                               FROM messages GROUP BY 1""").fetchall():
+        _bump_daily(conn, day, messages=count, skipped=skipped)
+        conn.execute("UPDATE daily_stats SET failed = MAX(failed - ?, 0) WHERE day = ?", (skipped, day))
+    backfill = {}
+    for row_id, day, error in conn.execute("""SELECT d.message_row_id, substr(m.msg_date, 1, 10), d.error
+                                              FROM deliveries d JOIN messages m ON m.id = d.message_row_id
+                                              WHERE d.status IN ('failed', 'skipped')"""):
+        key = (day, row_id, error_class(error))
+        backfill[key] = backfill.get(key, 0) + 1
+    _bump_errors(conn, backfill)
+
+def _enable_incremental_vacuum(conn: sqlite3.Connection):
+    # the switch to incremental auto_vacuum itself is ensure_incremental_vacuum(), outside the chain
+    _add_column(conn, "messages", "archived_at", "TEXT")
+
+# Delivery status is stored as its index in this tuple.
+DELIVERY_STATUSES = ("pending", "sent", "failed", "skipped")
+PENDING, SENT, FAILED, SKIPPED = range(len(DELIVERY_STATUSES))
+
+def _compact_schema(conn: sqlite3.Connection):
+    # chat ids become INTEGER, deliveries drop their rowid (keyed by job and target) and store a
+    # status code and an interned error id instead of two repeated strings per row
+    conn.execute("""CREATE TABLE IF NOT EXISTS error_kinds (id INTEGER PRIMARY KEY, text TEXT NOT NULL UNIQUE)""")
+    conn.execute("INSERT OR IGNORE INTO error_kinds (id, text) VALUES (0, '')")
+    conn.execute("INSERT OR IGNORE INTO error_kinds (text) SELECT DISTINCT error FROM deliveries WHERE error != ''")
+    conn.execute("""CREATE TABLE deliveries_compact (
+        message_row_id INTEGER NOT NULL, target_chat_id INTEGER NOT NULL, status INTEGER NOT NULL DEFAULT 0,
+        error_kind INTEGER NOT NULL DEFAULT 0, PRIMARY KEY (message_row_id, target_chat_id)
+    ) WITHOUT ROWID""")
+    conn.execute("""INSERT OR IGNORE INTO deliveries_compact (message_row_id, target_chat_id, status, error_kind)
+                    SELECT d.message_row_id, CAST(d.target_chat_id AS INTEGER),
+                           CASE d.status WHEN 'pending' THEN 0 WHEN 'sent' THEN 1 WHEN 'skipped' THEN 3 ELSE 2 END,
+                           COALESCE(e.id, 0)
+                    FROM deliveries d LEFT JOIN error_kinds e ON e.text = d.error""")
+    conn.execute("DROP TABLE deliveries")
+    conn.execute("ALTER TABLE deliveries_compact RENAME TO deliveries")
+    conn.execute("CREATE INDEX deliveries_job_status ON deliveries (message_row_id, status)")
+    conn.execute("""CREATE TABLE chats_compact (
+        chat_id INTEGER PRIMARY KEY, type TEXT, title TEXT, username TEXT, added_by INTEGER, added_at TEXT,
+        active INTEGER NOT NULL DEFAULT 1, fail_streak INTEGER NOT NULL DEFAULT 0
+    )""")
+    conn.execute("""INSERT OR IGNORE INTO chats_compact
+                    SELECT CAST(chat_id AS INTEGER), type, title, username, added_by, added_at, active, fail_streak FROM chats""")
+    conn.execute("DROP TABLE chats")
+    conn.execute("ALTER TABLE chats_compact RENAME TO chats")
+
+def _add_job_lanes(conn: sqlite3.Connection):
+    _add_column(conn, "broadcast_jobs", "lane", "INTEGER NOT NULL DEFAULT 2")  # BULK
+
+def _add_message_map(conn: sqlite3.Connection):
+    # where each copied post landed, so edits and deletions of the source can follow it
+    conn.execute("""CREATE TABLE IF NOT EXISTS message_map (
+        source_chat_id INTEGER NOT NULL, source_message_id INTEGER NOT NULL, target_chat_id INTEGER NOT NULL,
+        target_message_id INTEGER NOT NULL, PRIMARY KEY (source_chat_id, source_message_id, target_chat_id)
+    ) WITHOUT ROWID""")
+
+def _error_kind_ids(conn: sqlite3.Connection, texts) -> Dict[str, int]:
+    """Interns error texts in `error_kinds`; returns text -> id."""
+    texts = set(texts)
+    conn.executemany("INSERT OR IGNORE INTO error_kinds (text) VALUES (?)", [(t,) for t in texts])
+    return {t: conn.execute("SELECT id FROM error_kinds WHERE text = ?", (t,)).fetchone()[0] for t in texts}
+
+def ensure_incremental_vacuum(conn: sqlite3.Connection):
+    """Switches the file to auto_vacuum=INCREMENTAL so retention can hand pages back in small steps.
+
+    That takes a full VACUUM, which cannot run inside a transaction and needs free disk of
+    about the DB's size. It is not a versioned migration: a failed or interrupted attempt
+    leaves the DB usable as it was and is simply retried on the next start.
+    """
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:  # INCREMENTAL
+        return
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    try:
+        conn.execute("VACUUM")
+    except sqlite3.OperationalError as e:
+        logger.warning("VACUUM for incremental auto_vacuum failed, will retry on next start: %s", e)
+
+# Applied in order; PRAGMA user_version records how many have run. Append, never reorder.
+SCHEMA_MIGRATIONS = [
+    _create_schema,
+    _add_lookup_indexes,
+    _add_aggregates,
+    _enable_incremental_vacuum,
+    _compact_schema,
+    _add_job_lanes,
+    _add_message_map,
+]
+
+def _migrate_schema(conn: sqlite3.Connection):
+    """Applies pending migrations on an autocommit connection. Each step runs in one explicit
+    transaction with its user_version bump (SQLite DDL is transactional), so a step that
+    fails leaves the DB exactly at the previous version."""
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for step, migration in enumerate(SCHEMA_MIGRATIONS[version:], start=version + 1):
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            migration(conn)
+            conn.execute(f"PRAGMA user_version = {step}")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        logger.info("Schema migrated to version %s (%s)", step, migration.__name__)
+    conn.execute("INSERT OR IGNORE INTO admins (user_id, added_at) VALUES (?, ?)", (MAIN_ADMIN_ID, now_iso()))
+
+def migrate_db(path: str):
+    # its own connection: the writer's connection uses implicit transactions, in which
+    # DDL would commit on its own
+    conn = open_connection(path)
+    conn.isolation_level = None
+    try:
+        _migrate_schema(conn)
+        ensure_incremental_vacuum(conn)
+    finally:
+        conn.close()
 
-def json_add_group(chat_id, title):
-    ensure_json()
-    with open(JSON_PATH, "r", encoding="utf-8") as f:
-        d = json.load(f)
-    today = datetime.utcnow().strftime("%Y-%m-%d")
-    d.setdefault("groups_added_by_date", {})
-    d["groups_added_by_date"].setdefault(today, [])
-    d["groups_added_by_date"][today].append({"id": chat_id, "title": title})
-    with open(JSON_PATH, "w", encoding="utf-8") as f:
-        json.dump(d, f, indent=2, ensure_ascii=False)
-
-def json_add_message(sent, failed):
-    ensure_json()
-    with open(JSON_PATH, "r", encoding="utf-8") as f:
-        d = json.load(f)
-    today = datetime.utcnow().strftime("%Y-%m-%d")
-    d.setdefault("messages_by_date", {})
-    d["messages_by_date"].setdefault(today, {"sent": 0, "failed": 0})
-    d["messages_by_date"][today]["sent"] += sent
-    d["messages_by_date"][today]["failed"] += failed
-    with open(JSON_PATH, "w", encoding="utf-8") as f:
-        json.dump(d, f, indent=2, ensure_ascii=False)
-
-def json_log_left(chat_id, title):
-    ensure_json()
-    with open(JSON_PATH, "r", encoding="utf-8") as f:
-        d = json.load(f)
-    d.setdefault("left_chats", [])
-    d["left_chats"].append({"id": chat_id, "title": title, "removed_at": now_iso()})
-    with open(JSON_PATH, "w", encoding="utf-8") as f:
-        json.dump(d, f, indent=2, ensure_ascii=False)
+# Lookups that must stay index-only as history grows; see explain_queries().
+INDEXED_QUERIES = {
+    "report by date": ("SELECT id, msg_date, content_type, text_preview, total_target, total_sent, total_failed "
+                       "FROM messages WHERE msg_date BETWEEN ? AND ? ORDER BY msg_date DESC, id DESC", ("", "")),
+    "report by day range": ("SELECT day, messages, sent, failed, skipped, groups_added, groups_left "
+                            "FROM daily_stats WHERE day BETWEEN ? AND ? ORDER BY day", ("", "")),
+    "errors by day range": ("SELECT error_class, SUM(count) FROM daily_errors WHERE day BETWEEN ? AND ? "
+                            "GROUP BY error_class ORDER BY 2 DESC LIMIT 5", ("", "")),
+    "errors by job": ("SELECT error_class, count FROM message_errors WHERE message_row_id = ? ORDER BY count DESC LIMIT 5", (0,)),
+    "failures by job": ("SELECT d.target_chat_id, d.status, e.text FROM deliveries d JOIN error_kinds e ON e.id = d.error_kind "
+                        "WHERE d.message_row_id = ? AND d.status IN (?, ?) LIMIT 50", (0, FAILED, SKIPPED)),
+    "pending targets": ("SELECT target_chat_id FROM deliveries WHERE message_row_id = ? AND status = ?", (0, PENDING)),
+    "pending jobs": ("SELECT message_row_id FROM broadcast_jobs WHERE state = 'pending'", ()),
+}
+
+def explain_queries() -> Dict[str, List[str]]:
+    """EXPLAIN QUERY PLAN details for INDEXED_QUERIES; a 'SCAN <table>' step means a full table scan."""
+    return {name: [row[3] for row in db_read("EXPLAIN QUERY PLAN " + sql, params)]
+            for name, (sql, params) in INDEXED_QUERIES.items()}
 
-def json_add_admin(uid):
-    ensure_json()
-    with open(JSON_PATH, "r", encoding="utf-8") as f:
-        d = json.load(f)
-    d.setdefault("admins", [])
-    if uid not in d["admins"]:
-        d["admins"].append(uid)
-    with open(JSON_PATH, "w", encoding="utf-8") as f:
-        json.dump(d, f, indent=2, ensure_ascii=False)
-
-def json_remove_admin(uid):
-    ensure_json()
+def init_db():
+    migrate_db(DB_PATH)
+    start_db()
+    import_legacy_json()
+    admin_cache.load()
+    chat_registry.load()
+    dead_chats.load()
+
+# ---------------- Date-wise logs ----------------
+# Chat joins/leaves are appended to `chat_events`; per-day totals live in `daily_stats`
+# and are bumped with atomic upserts inside the same transaction as the change they count.
+def today_str():
+    return datetime.utcnow().strftime("%Y-%m-%d")
+
+def _bump_daily(conn: sqlite3.Connection, day: str, **deltas):
+    cols = ", ".join(deltas)
+    marks = ", ".join("?" for _ in deltas)
+    updates = ", ".join(f"{c} = {c} + excluded.{c}" for c in deltas)
+    conn.execute(f"INSERT INTO daily_stats (day, {cols}) VALUES (?, {marks}) ON CONFLICT(day) DO UPDATE SET {updates}",
+                 (day, *deltas.values()))
+
+def error_class(error: str) -> str:
+    """Groups delivery errors for the aggregates: ids and counts are masked so
+    'migrated to -100123' and 'Retry in 7 seconds' collapse into one class each."""
+    return re.sub(r"-?\d+", "N", error or "unknown")[:80]
+
+def _bump_errors(conn: sqlite3.Connection, counts: dict):
+    """counts maps (day, message_row_id, error_class) -> occurrences."""
+    per_day = {}
+    for (day, _, cls), n in counts.items():
+        per_day[(day, cls)] = per_day.get((day, cls), 0) + n
+    conn.executemany("""INSERT INTO daily_errors (day, error_class, count) VALUES (?, ?, ?)
+                        ON CONFLICT(day, error_class) DO UPDATE SET count = count + excluded.count""",
+                     [(day, cls, n) for (day, cls), n in per_day.items()])
+    conn.executemany("""INSERT INTO message_errors (message_row_id, error_class, count) VALUES (?, ?, ?)
+                        ON CONFLICT(message_row_id, error_class) DO UPDATE SET count = count + excluded.count""",
+                     [(row_id, cls, n) for (_, row_id, cls), n in counts.items()])
+
+def _log_chat_event(conn: sqlite3.Connection, kind: str, chat_id, title: str, at: Optional[str] = None):
+    at = at or now_iso()
+    conn.execute("INSERT INTO chat_events (day, kind, chat_id, title, at) VALUES (?, ?, ?, ?, ?)",
+                 (at[:10], kind, str(chat_id), title or "", at))
+    _bump_daily(conn, at[:10], **{"groups_added" if kind == "added" else "groups_left": 1})
+
+def _import_legacy(conn: sqlite3.Connection, d: dict):
+    for day, groups in d.get("groups_added_by_date", {}).items():
+        for g in groups:
+            _log_chat_event(conn, "added", g.get("id"), g.get("title"), f"{day}T00:00:00")
+    # legacy `failed` counts include skipped deliveries, which daily_stats keeps apart; the
+    # aggregates migration has already filled `skipped` from the messages table
+    skipped = dict(conn.execute("SELECT substr(msg_date, 1, 10), SUM(total_skipped) FROM messages GROUP BY 1"))
+    for day, counts in d.get("messages_by_date", {}).items():
+        failed = max(counts.get("failed", 0) - (skipped.get(day) or 0), 0)
+        _bump_daily(conn, day, sent=counts.get("sent", 0), failed=failed)
+    for left in d.get("left_chats", []):
+        _log_chat_event(conn, "left", left.get("id"), left.get("title"), left.get("removed_at") or now_iso())
+
+def import_legacy_json():
+    """Moves an existing data.json into the event log once; the file is renamed afterwards."""
+    if not os.path.exists(JSON_PATH):
+        return
     with open(JSON_PATH, "r", encoding="utf-8") as f:
         d = json.load(f)
-    d.setdefault("admins", [])
-    if uid in d["admins"]:
-        d["admins"].remove(uid)
-    with open(JSON_PATH, "w", encoding="utf-8") as f:
-        json.dump(d, f, indent=2, ensure_ascii=False)
+    db_write(_import_legacy, d)
+    os.replace(JSON_PATH, JSON_PATH + ".imported")
+    logger.info("Imported legacy %s into the event log", JSON_PATH)
+
+def export_legacy_json() -> dict:
+    """Rebuilds the old data.json structure from the event log and daily counters."""
+    groups_added, left_chats = {}, []
+    for day, kind, chat_id, title, at in db_read("SELECT day, kind, chat_id, title, at FROM chat_events ORDER BY id"):
+        if kind == "added":
+            groups_added.setdefault(day, []).append({"id": chat_id, "title": title})
+        else:
+            left_chats.append({"id": chat_id, "title": title, "removed_at": at})
+    messages = {day: {"sent": sent, "failed": failed} for day, sent, failed in
+                db_read("SELECT day, sent, failed FROM daily_stats WHERE sent > 0 OR failed > 0 ORDER BY day")}
+    return {"groups_added_by_date": groups_added, "messages_by_date": messages,
+            "admins": list_admins_db(), "left_chats": left_chats}
+
+# ---------------- Admin cache ----------------
+def _read_admin_generation() -> int:
+    row = db_read_one("SELECT value FROM meta WHERE key = 'admins_generation'")
+    return row[0] if row else 0
+
+def _bump_admin_generation(conn: sqlite3.Connection) -> int:
+    conn.execute("""INSERT INTO meta (key, value) VALUES ('admins_generation', 1)
+                    ON CONFLICT(key) DO UPDATE SET value = value + 1""")
+    return conn.execute("SELECT value FROM meta WHERE key = 'admins_generation'").fetchone()[0]
+
+class AdminCache:
+    """In-process copy of the admins table, kept current by write-through.
+
+    Every admin write bumps `meta.admins_generation`; when `recheck` > 0 a lookup
+    compares that counter at most once per `recheck` seconds and reloads if another
+    process sharing the DB changed the table.
+    """
+
+    def __init__(self, recheck: float = 0.0):
+        self.recheck = recheck
+        self.generation = 0
+        self._ids = set()
+        self._checked_at = 0.0
+
+    def load(self):
+        self.generation = _read_admin_generation()
+        self._ids = {r[0] for r in db_read("SELECT user_id FROM admins")}
+        self._checked_at = time.monotonic()
+
+    def _applied(self, generation: int):
+        # a gap means another process wrote in between; our view is stale
+        if generation != self.generation + 1:
+            self.load()
+        self.generation = generation
+
+    def added(self, user_id: int, generation: int):
+        self._ids.add(user_id)
+        self._applied(generation)
+
+    def removed(self, user_id: int, generation: int):
+        self._ids.discard(user_id)
+        self._applied(generation)
+
+    def __contains__(self, user_id: int) -> bool:
+        if self.recheck > 0 and time.monotonic() - self._checked_at > self.recheck:
+            self._checked_at = time.monotonic()
+            if _read_admin_generation() != self.generation:
+                self.load()
+        return user_id in self._ids
+
+    def __len__(self):
+        return len(self._ids)
+
+admin_cache = AdminCache(ADMIN_CACHE_RECHECK)
+
+# ---------------- Chat registry ----------------
+ChatRecord = namedtuple("ChatRecord", "chat_id type title username added_by added_at active", defaults=(1,))
+BROADCAST_CHAT_TYPES = ("group", "supergroup")
+
+class ChatRegistry:
+    """In-memory mirror of the chats table, updated write-through by add_chat_db /
+    remove_chat_db. Keeps the broadcast target ids precomputed so a fan-out never
+    has to scan the table."""
+
+    def __init__(self):
+        self._chats = {}
+        self._targets = {}  # insertion-ordered set of group/supergroup ids
+        self._lock = threading.Lock()  # writers may run on executor threads
+
+    def load(self):
+        rows = list_chats_db()
+        with self._lock:
+            self._chats = {r[0]: ChatRecord(*r) for r in rows}
+            self._targets = dict.fromkeys(r[0] for r in rows if r[1] in BROADCAST_CHAT_TYPES and r[6])
+
+    def add(self, record: ChatRecord):
+        with self._lock:
+            self._chats[record.chat_id] = record
+            if record.type in BROADCAST_CHAT_TYPES and record.active:
+                self._targets[record.chat_id] = None
+
+    def deactivate(self, chat_id: int) -> Optional[ChatRecord]:
+        with self._lock:
+            record = self._chats.get(chat_id)
+            if record is not None:
+                self._chats[chat_id] = record._replace(active=0)
+            self._targets.pop(chat_id, None)
+        return record
+
+    def remove(self, chat_id: int):
+        with self._lock:
+            self._chats.pop(chat_id, None)
+            self._targets.pop(chat_id, None)
+
+    def rename(self, old_id: int, new_id: int):
+        with self._lock:
+            record = self._chats.pop(old_id, None)
+            self._targets.pop(old_id, None)
+            if record is None or new_id in self._chats:
+                return
+            self._chats[new_id] = record._replace(chat_id=new_id, type="supergroup", active=1)
+            self._targets[new_id] = None
+
+    def targets(self) -> List[int]:
+        with self._lock:
+            return list(self._targets)
+
+    def rows(self) -> List[ChatRecord]:
+        with self._lock:
+            records = list(self._chats.values())
+        return sorted(records, key=lambda r: r.added_at or "", reverse=True)
+
+    @property
+    def target_count(self) -> int:
+        return len(self._targets)
+
+    @property
+    def inactive_count(self) -> int:
+        return sum(1 for r in self._chats.values() if not r.active)
+
+    def __len__(self):
+        return len(self._chats)
+
+chat_registry = ChatRegistry()
 
 # ---------------- DB helpers ----------------
+def _insert_admin(conn: sqlite3.Connection, user_id: int) -> int:
+    conn.execute("INSERT INTO admins (user_id, added_at) VALUES (?, ?)", (user_id, now_iso()))
+    return _bump_admin_generation(conn)
+
+def _delete_admin(conn: sqlite3.Connection, user_id: int) -> Optional[int]:
+    if conn.execute("DELETE FROM admins WHERE user_id = ?", (user_id,)).rowcount == 0:
+        return None
+    return _bump_admin_generation(conn)
+
 def add_admin_db(user_id: int) -> bool:
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
     try:
-        cur.execute("INSERT INTO admins (user_id, added_at) VALUES (?, ?)", (int(user_id), now_iso()))
-        conn.commit()
+        generation = db_write(_insert_admin, int(user_id))
         added = True
     except sqlite3.IntegrityError:
         added = False
-    conn.close()
     if added:
-        json_add_admin(user_id)
+        admin_cache.added(int(user_id), generation)
     return added
 
 def remove_admin_db(user_id: int) -> bool:
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("DELETE FROM admins WHERE user_id = ?", (int(user_id),))
-    changed = cur.rowcount
-    conn.commit()
-    conn.close()
-    if changed:
-        json_remove_admin(user_id)
-    return changed > 0
+    generation = db_write(_delete_admin, int(user_id))
+    if generation is not None:
+        admin_cache.removed(int(user_id), generation)
+    return generation is not None
 
 def list_admins_db() -> List[int]:
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("SELECT user_id FROM admins ORDER BY added_at DESC")
-    rows = [r[0] for r in cur.fetchall()]
-    conn.close()
-    return rows
+    return [r[0] for r in db_read("SELECT user_id FROM admins ORDER BY added_at DESC")]
 
 def is_admin(user_id: int) -> bool:
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("SELECT 1 FROM admins WHERE user_id = ?", (int(user_id),))
-    ok = cur.fetchone() is not None
-    conn.close()
-    return ok
-
-def add_chat_db(chat_id: str, ctype: str, title: str = "", username: str = "", added_by: Optional[int] = None) -> bool:
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    try:
-        cur.execute("INSERT INTO chats (chat_id, type, title, username, added_by, added_at) VALUES (?, ?, ?, ?, ?, ?)",
-                    (str(chat_id), ctype, title or "", username or "", added_by, now_iso()))
-        conn.commit()
-        added = True
-    except sqlite3.IntegrityError:
-        added = False
-    conn.close()
+    return int(user_id) in admin_cache
+
+def _insert_chat(conn: sqlite3.Connection, record: ChatRecord) -> bool:
+    # re-adding a chat that was pruned as dead reactivates it
+    cur = conn.execute("""INSERT INTO chats (chat_id, type, title, username, added_by, added_at) VALUES (?, ?, ?, ?, ?, ?)
+                          ON CONFLICT(chat_id) DO UPDATE SET type = excluded.type, title = excluded.title,
+                              username = excluded.username, active = 1, fail_streak = 0
+                          WHERE active = 0""", record[:6])
+    if cur.rowcount == 0:
+        return False
+    _log_chat_event(conn, "added", record.chat_id, record.title, record.added_at)
+    return True
+
+def add_chat_db(chat_id: int, ctype: str, title: str = "", username: str = "", added_by: Optional[int] = None) -> bool:
+    record = ChatRecord(int(chat_id), ctype, title or "", username or "", added_by, now_iso())
+    added = db_write(_insert_chat, record)
     if added:
-        json_add_group(chat_id, title)
+        chat_registry.add(record)
     return added
 
-def remove_chat_db(chat_id: str) -> bool:
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("DELETE FROM chats WHERE chat_id = ?", (str(chat_id),))
-    changed = cur.rowcount
-    conn.commit()
-    conn.close()
+def remove_chat_db(chat_id: int) -> bool:
+    changed, _ = db_execute("DELETE FROM chats WHERE chat_id = ?", (int(chat_id),))
     if changed:
-        json_log_left(chat_id, "")
+        chat_registry.remove(int(chat_id))
     return changed > 0
 
 def list_chats_db():
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("SELECT chat_id, type, title, username, added_by, added_at FROM chats ORDER BY added_at DESC")
-    rows = cur.fetchall()
-    conn.close()
-    return rows
-
-# ---------------- Message logging helpers ----------------
-def create_message_row(msg: Message) -> int:
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    content_type = detect_content_type(msg)
-    preview = (msg.text or (getattr(msg, "caption", "") or ""))[:300]
-    cur.execute("INSERT INTO messages (msg_date, from_user, from_chat_id, message_id, content_type, text_preview, total_target, total_sent, total_failed) VALUES (?, ?, ?, ?, ?, ?, 0, 0, 0)",
-                (now_iso(), msg.from_user.id if msg.from_user else None, str(msg.chat_id), msg.message_id, content_type, preview))
-    row_id = cur.lastrowid
-    conn.commit()
-    conn.close()
-    return row_id
+    return db_read("SELECT chat_id, type, title, username, added_by, added_at, active FROM chats ORDER BY added_at DESC")
 
-def update_message_counts(row_id: int, target_total: int, sent: int, failed: int):
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("UPDATE messages SET total_target=?, total_sent=?, total_failed=? WHERE id=?", (target_total, sent, failed, row_id))
-    conn.commit()
-    conn.close()
-
-def add_delivery_record(message_row_id: int, target_chat_id: str, status: str, error: Optional[str] = None):
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("INSERT INTO deliveries (message_row_id, target_chat_id, status, error) VALUES (?, ?, ?, ?)",
-                (message_row_id, str(target_chat_id), status, error or ""))
-    conn.commit()
-    conn.close()
+def _insert_left_chat(conn: sqlite3.Connection, chat_id: str, title: str):
+    at = now_iso()
+    conn.execute("INSERT OR REPLACE INTO left_chats (chat_id, title, removed_at) VALUES (?, ?, ?)", (chat_id, title, at))
+    _log_chat_event(conn, "left", chat_id, title, at)
 
 def log_left_chat(chat_id: str, title: str):
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("INSERT OR REPLACE INTO left_chats (chat_id, title, removed_at) VALUES (?, ?, ?)", (str(chat_id), title or "", now_iso()))
-    conn.commit()
-    conn.close()
+    db_write(_insert_left_chat, str(chat_id), title or "")
+
+def _migrate_chat(conn: sqlite3.Connection, old_id: int, new_id: int):
+    if conn.execute("SELECT 1 FROM chats WHERE chat_id = ?", (new_id,)).fetchone():
+        conn.execute("DELETE FROM chats WHERE chat_id = ?", (old_id,))
+    else:
+        conn.execute("UPDATE chats SET chat_id = ?, type = 'supergroup', active = 1, fail_streak = 0 WHERE chat_id = ?",
+                     (new_id, old_id))
+    # a job that already targets both ids keeps its row for the old one
+    conn.execute("UPDATE OR IGNORE deliveries SET target_chat_id = ? WHERE target_chat_id = ?", (new_id, old_id))
+
+async def migrate_chat(old_id: int, new_id: int):
+    """Moves a group that was upgraded to a supergroup over to its new id: the chats row,
+    delivery rows and the in-memory caches, so it stays a broadcast target."""
+    if old_id == new_id:
+        return
+    await delivery_log.flush()  # buffered outcomes still reference the old id
+    await adb_write(_migrate_chat, old_id, new_id)
+    chat_registry.rename(old_id, new_id)
+    admin_presence.forget(old_id)
+    dead_chats.forget(old_id)
+    logger.info("Chat %s migrated to supergroup %s", old_id, new_id)
+
+def _set_fail_streak(conn: sqlite3.Connection, chat_id: int, streak: int):
+    conn.execute("UPDATE chats SET fail_streak = ? WHERE chat_id = ?", (streak, chat_id))
 
+def _deactivate_chat(conn: sqlite3.Connection, chat_id: int, title: str, streak: int):
+    conn.execute("UPDATE chats SET active = 0, fail_streak = ? WHERE chat_id = ?", (streak, chat_id))
+    _insert_left_chat(conn, str(chat_id), title)
+
+# Message & delivery logging
+def _write_deliveries(conn: sqlite3.Connection, rows: list, copies: list = ()):
+    # only pending rows move, so a (job, target) outcome is recorded exactly once
+    kinds = _error_kind_ids(conn, (r[3] for r in rows))
+    conn.executemany("""UPDATE deliveries SET status = ?, error_kind = ?
+                        WHERE message_row_id = ? AND target_chat_id = ? AND status = ?""",
+                     [(DELIVERY_STATUSES.index(status), kinds[error], row_id, target, PENDING)
+                      for row_id, target, status, error in rows])
+    day = today_str()
+    counters, errors = {}, {}
+    for row_id, _, status, error in rows:
+        counts = counters.setdefault(row_id, {"sent": 0, "failed": 0, "skipped": 0})
+        counts[status if status in counts else "failed"] += 1
+        if status != "sent":
+            key = (day, row_id, error_class(error))
+            errors[key] = errors.get(key, 0) + 1
+    conn.executemany("""UPDATE messages SET total_sent = total_sent + ?, total_failed = total_failed + ?,
+                        total_skipped = total_skipped + ? WHERE id = ?""",
+                     [(c["sent"], c["failed"], c["skipped"], row_id) for row_id, c in counters.items()])
+    _bump_daily(conn, day, **{k: sum(c[k] for c in counters.values()) for k in ("sent", "failed", "skipped")})
+    _bump_errors(conn, errors)
+    conn.executemany("""INSERT OR REPLACE INTO message_map (source_chat_id, source_message_id, target_chat_id, target_message_id)
+                        SELECT CAST(from_chat_id AS INTEGER), ?, ?, ? FROM broadcast_jobs WHERE message_row_id = ?""",
+                     [(source_id, target, target_id, row_id) for row_id, target, source_id, target_id in copies])
+
+class DeliveryLog:
+    """In-memory buffer for delivery rows.
+
+    Rows (outcomes of 'pending' deliveries) are written with a single executemany per flush, together with the matching
+    `messages` counters, once `max_rows` are buffered or `max_delay` seconds have passed
+    since the first unflushed row. Callers await flush() when a broadcast finishes.
+    A write that fails puts its rows back in the buffer, so outcomes are retried, never dropped.
+    """
+
+    def __init__(self, max_rows: int, max_delay: float):
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        self._rows = []
+        self._copies = []  # (job, target, source message id, target message id) of copied posts, for message_map
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._in_flight = set()
+
+    def add(self, message_row_id: int, target_chat_id, status: str, error: Optional[str] = None, copies=()):
+        """`copies` pairs each source message id with the id of its copy in the target."""
+        self._rows.append((message_row_id, int(target_chat_id), status, error or ""))
+        self._copies.extend((message_row_id, int(target_chat_id), source_id, target_id) for source_id, target_id in copies)
+        if len(self._rows) >= self.max_rows:
+            self._submit()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.max_delay, self._submit)
+
+    def _submit(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._rows:
+            return
+        rows, self._rows = self._rows, []
+        copies, self._copies = self._copies, []
+        # wrapped so the done callback runs on the event loop, not on the writer thread
+        fut = asyncio.wrap_future(_db_writer.submit(_write_deliveries, rows, copies))
+        self._in_flight.add(fut)
+        fut.add_done_callback(lambda f: self._done(f, rows, copies))
+
+    def _done(self, fut: asyncio.Future, rows: list, copies: list):
+        self._in_flight.discard(fut)
+        if fut.exception() is None:
+            return
+        logger.error("Delivery log flush of %d rows failed, will retry: %s", len(rows), fut.exception())
+        self._rows[:0] = rows
+        self._copies[:0] = copies
+        if self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.max_delay, self._submit)
+
+    async def flush(self, attempts: int = 3) -> bool:
+        """Writes everything buffered; returns False if rows are still unwritten after `attempts` tries."""
+        for attempt in range(attempts):
+            if attempt:
+                await asyncio.sleep(backoff_delay(attempt))
+            self._submit()
+            pending = list(self._in_flight)
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+            if not self._rows:
+                return True
+        return False
+
+delivery_log = DeliveryLog(DELIVERY_FLUSH_ROWS, DELIVERY_FLUSH_MS / 1000)
+
+# Utilities
 def detect_content_type(msg: Message) -> str:
     if msg.text:
         return "text"
@@ -269,52 +936,1136 @@ def detect_content_type(msg: Message) -> str:
         return "sticker"
     return "other"
 
-# ---------------- Safe copy and checks ----------------
-async def safe_copy(bot, from_chat_id, message_id, to_chat_id):
+# Albums arrive as one update per item sharing a media_group_id; they are broadcast as a
+# single send_media_group per group, rebuilt from the items' file ids.
+ALBUM_MEDIA = {"photo": InputMediaPhoto, "video": InputMediaVideo, "document": InputMediaDocument, "audio": InputMediaAudio}
+
+def album_item(msg: Message) -> dict:
+    kind = detect_content_type(msg)
+    media = msg.photo[-1] if kind == "photo" else getattr(msg, kind)
+    return {"id": msg.message_id, "type": kind, "file_id": media.file_id, "caption": msg.caption,
+            "caption_entities": [e.to_dict() for e in msg.caption_entities or ()]}
+
+def album_media(items: List[dict]) -> list:
+    return [ALBUM_MEDIA[i["type"]](i["file_id"], caption=i["caption"],
+                                   caption_entities=[MessageEntity.de_json(e, None) for e in i["caption_entities"]] or None)
+            for i in items]
+
+def job_source_ids(kind: str, message_id: int, text: Optional[str]) -> List[int]:
+    """Source message ids a job copies: the album's items, or the one copied post."""
+    if kind == "album":
+        return [i["id"] for i in json.loads(text)]
+    return [message_id] if kind == "copy" else []
+
+class AlbumCollector:
+    """Buffers the items of a media group and hands the whole album to `on_album` once
+    no new item arrived for `delay` seconds. Anything else from the same chat releases
+    the chat's pending albums first, so jobs keep the order the posts were made in."""
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self._albums = {}  # (chat id, media_group_id) -> (items, timer, on_album)
+        self._releasing = {}  # chat id -> tasks of released albums not yet queued
+
+    def add(self, msg: Message, on_album):
+        key = (msg.chat_id, msg.media_group_id)
+        if key not in self._albums:
+            self._release_chat(msg.chat_id)
+        items, timer, _ = self._albums.get(key, ([], None, None))
+        if timer is not None:
+            timer.cancel()
+        items.append(msg)
+        timer = asyncio.get_running_loop().call_later(self.delay, self._release, key)
+        self._albums[key] = (items, timer, on_album)
+
+    def _release(self, key):
+        items, timer, on_album = self._albums.pop(key)
+        timer.cancel()
+        task = spawn(on_album(sorted(items, key=lambda m: m.message_id)))
+        tasks = self._releasing.setdefault(key[0], set())
+        tasks.add(task)
+        task.add_done_callback(lambda t: self._released(key[0], t))
+
+    def _released(self, chat_id, task: asyncio.Task):
+        tasks = self._releasing.get(chat_id, set())
+        tasks.discard(task)
+        if not tasks:
+            self._releasing.pop(chat_id, None)
+
+    def _release_chat(self, chat_id):
+        for key in [k for k in self._albums if k[0] == chat_id]:
+            self._release(key)
+
+    async def flush(self, chat_id):
+        """Queues the chat's pending albums now and returns once they are queued."""
+        self._release_chat(chat_id)
+        tasks = self._releasing.get(chat_id)
+        if tasks:
+            await asyncio.wait(list(tasks))
+
+album_collector = AlbumCollector(ALBUM_COLLECT_SECONDS)
+
+async def safe_copy(bot, from_chat_id, message_id, to_chat_id, flow):
+    return await deliver(to_chat_id, "copy_message", lambda: bot.copy_message(
+        chat_id=to_chat_id, from_chat_id=int(from_chat_id), message_id=int(message_id)), flow)
+
+async def check_group_has_admins(bot, chat_id) -> Optional[bool]:
+    # None when the check itself failed, so the answer isn't cached. A flood wait is not an
+    # answer: it pauses the sender like deliver() does and is re-raised for the caller to requeue.
+    started = time.perf_counter()
     try:
-        await bot.copy_message(chat_id=int(to_chat_id), from_chat_id=int(from_chat_id), message_id=int(message_id))
-        return True, None
+        admins = await bot.get_chat_administrators(chat_id=chat_id)
+        API_REQUESTS.inc(method="get_chat_administrators", outcome="ok")
+        return len(admins) > 0
+    except RetryAfter as e:
+        API_REQUESTS.inc(method="get_chat_administrators", outcome=FLOOD_WAIT)
+        FLOOD_WAITS.inc()
+        global_bucket.flood_wait(e.retry_after)
+        raise
     except Exception as e:
-        return False, str(e)
+        API_REQUESTS.inc(method="get_chat_administrators", outcome=classify_error(e))
+        return None
+    finally:
+        API_LATENCY.observe(time.perf_counter() - started, method="get_chat_administrators")
+
+class AdminPresenceCache:
+    """TTL + LRU cache of check_group_has_admins() results.
+
+    Lookups never wait on the API once a chat has been seen: a stale entry is still
+    returned and the chat is queued for a background refresh. chat_member /
+    my_chat_member updates drop the entry and queue a refresh too.
+    """
+
+    def __init__(self, ttl: float, max_size: int):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()  # chat_id -> (has_admins, checked_at)
+        self._refresh = asyncio.Queue()
+        self._queued = set()
+
+    def get(self, chat_id: int) -> Optional[bool]:
+        entry = self._entries.get(chat_id)
+        if entry is None:
+            ADMIN_CHECK_CACHE.inc(result="miss")
+            return None
+        self._entries.move_to_end(chat_id)
+        if time.monotonic() - entry[1] > self.ttl:
+            ADMIN_CHECK_CACHE.inc(result="stale")
+            self._schedule(chat_id)
+        else:
+            ADMIN_CHECK_CACHE.inc(result="hit")
+        return entry[0]
+
+    def put(self, chat_id: int, has_admins: bool):
+        self._entries[chat_id] = (has_admins, time.monotonic())
+        self._entries.move_to_end(chat_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, chat_id: int):
+        if self._entries.pop(chat_id, None) is not None:
+            self._schedule(chat_id)
+
+    def forget(self, chat_id: int):
+        self._entries.pop(chat_id, None)
+
+    def _schedule(self, chat_id: int):
+        if chat_id not in self._queued:
+            self._queued.add(chat_id)
+            self._refresh.put_nowait(chat_id)
+
+    async def run(self, bot):
+        _scheduled_sends.set(True)
+        flow = scheduler.open("admin-refresh", BULK)
+        while True:
+            chat_id = await self._refresh.get()
+            self._queued.discard(chat_id)
+            await scheduler.acquire(flow)
+            try:
+                has_admins = await check_group_has_admins(bot, chat_id)
+            except RetryAfter:
+                self._schedule(chat_id)
+                continue
+            if has_admins is not None:
+                self.put(chat_id, has_admins)
+
+admin_presence = AdminPresenceCache(ADMIN_CHECK_TTL, ADMIN_CHECK_CACHE_SIZE)
+
+# ---------------- Rate limiting / fan-out ----------------
+class TokenBucket:
+    """Async token bucket: `rate` tokens per second, bursting up to `rate` tokens.
+
+    The rate adapts AIMD-style: halved once per flood event (down to `min_rate`), and
+    raised by one token/s after roughly a second's worth of clean sends (up to `max_rate`).
+    """
+
+    def __init__(self, rate: float, min_rate: float = 1.0):
+        self.max_rate = rate
+        self.min_rate = min(min_rate, rate)
+        self.rate = rate
+        self._tokens = rate
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._clean_sends = 0
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(max(self.rate, 1.0), self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        # the lock keeps waiters FIFO so a burst of workers can't starve each other
+        async with self._lock:
+            while True:
+                pause = self._paused_until - time.monotonic()
+                if pause > 0:
+                    await asyncio.sleep(pause)
+                    continue
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def flood_wait(self, seconds: float):
+        """Stop all sending for `seconds` and back the rate off after a 429."""
+        now = time.monotonic()
+        # requests already in flight get the same 429 burst; only the first one of a
+        # flood window lowers the rate, the rest may just extend the pause
+        new_window = now >= self._paused_until
+        self._paused_until = max(self._paused_until, now + seconds)
+        self._tokens = 0.0
+        self._clean_sends = 0
+        if not new_window:
+            return
+        new_rate = max(self.min_rate, self.rate / 2)
+        if new_rate < self.rate:
+            logger.warning("Flood wait %.1fs — send rate lowered to %.1f/s", seconds, new_rate)
+        self.rate = new_rate
+
+    def record_success(self):
+        self._clean_sends += 1
+        if self.rate < self.max_rate and self._clean_sends >= self.rate:
+            self.rate = min(self.max_rate, self.rate + 1)
+            self._clean_sends = 0
+
+class ChatLimiter:
+    """Spaces consecutive sends to the same chat at least `interval` seconds apart."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._next_at = {}
+
+    async def acquire(self, chat_id):
+        now = time.monotonic()
+        if len(self._next_at) > 10000:
+            self._next_at = {k: v for k, v in self._next_at.items() if v > now}
+        start = max(now, self._next_at.get(chat_id, 0.0))
+        self._next_at[chat_id] = start + self.interval
+        if start > now:
+            await asyncio.sleep(start - now)
+
+global_bucket = TokenBucket(GLOBAL_RATE_LIMIT, MIN_RATE_LIMIT)
+chat_limiter = ChatLimiter(PER_CHAT_INTERVAL)
+
+# ---------------- Send scheduler ----------------
+# Every Bot API call waits for a grant from one scheduler in front of global_bucket. Lanes
+# are strictly prioritised; within a lane, flows (one per broadcast job) share the rate by
+# weighted fair queuing, so a huge broadcast can't starve a small one started after it.
+INTERACTIVE, CHANNEL, BULK = range(3)
+LANE_NAMES = ("interactive", "channel", "bulk")
+
+class BroadcastCancelled(Exception):
+    pass
+
+class Flow:
+    """A stream of sends competing for the rate budget: one broadcast job, a background
+    task, or the interactive lane."""
+
+    def __init__(self, flow_id, lane: int, weight: float = 1.0):
+        self.id = flow_id
+        self.lane = lane
+        self.weight = weight
+        self.vtime = 0.0  # virtual finish time of the last grant
+        self.paused = False
+        self.cancelled = False
+        self.waiters = deque()
+
+class SendScheduler:
+    """Hands out global_bucket tokens: to the highest-priority lane with an unpaused waiting
+    flow, and inside it to the flow with the lowest virtual time, which then advances by
+    1 / weight."""
+
+    def __init__(self, bucket: TokenBucket):
+        self.bucket = bucket
+        self.flows = {}
+        self.interactive = self.open("interactive", INTERACTIVE)
+        self.running = False
+        self.draining = False
+        self.in_flight = 0  # granted API calls that have not returned yet (see deliver)
+        self._lane_vtime = [0.0] * len(LANE_NAMES)
+        self._wakeup: Optional[asyncio.Event] = None
+
+    def open(self, flow_id, lane: int, weight: float = 1.0) -> Flow:
+        flow = Flow(flow_id, lane, weight)
+        # new flows start at the lane's current virtual time instead of with a backlog of credit
+        flow.vtime = self._lane_vtime[lane] if self.flows else 0.0
+        self.flows[flow_id] = flow
+        return flow
+
+    def close(self, flow: Flow):
+        self.flows.pop(flow.id, None)
+        self._fail_waiters(flow)
+
+    def pause(self, flow_id) -> bool:
+        flow = self.flows.get(flow_id)
+        if flow is None:
+            return False
+        flow.paused = True
+        return True
+
+    def resume(self, flow_id) -> bool:
+        flow = self.flows.get(flow_id)
+        if flow is None:
+            return False
+        flow.paused = False
+        self._catch_up(flow)
+        self._wake()
+        return True
+
+    def cancel(self, flow_id) -> bool:
+        flow = self.flows.get(flow_id)
+        if flow is None:
+            return False
+        flow.cancelled = True
+        self._fail_waiters(flow)
+        return True
+
+    async def acquire(self, flow: Flow):
+        if flow.cancelled:
+            raise BroadcastCancelled(flow.id)
+        fut = asyncio.get_running_loop().create_future()
+        if not flow.waiters:
+            self._catch_up(flow)
+        flow.waiters.append(fut)
+        self._wake()
+        await fut
+
+    def _catch_up(self, flow: Flow):
+        # a flow that was idle, paused or queued behind its source's previous job must not
+        # come back with a backlog of credit and take every token in its lane
+        flow.vtime = max(flow.vtime, self._lane_vtime[flow.lane])
+
+    def _fail_waiters(self, flow: Flow):
+        while flow.waiters:
+            fut = flow.waiters.popleft()
+            if not fut.done():
+                fut.set_exception(BroadcastCancelled(flow.id))
+
+    def _wake(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def drain(self, timeout: float):
+        """Stops granting anything but interactive sends and waits up to `timeout` seconds
+        for granted calls to return, so their outcomes can be flushed before exit."""
+        self.draining = True
+        deadline = time.monotonic() + timeout
+        while self.in_flight and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        if self.in_flight:
+            logger.warning("Stopping with %d sends still in flight", self.in_flight)
+
+    def _next_flow(self) -> Optional[Flow]:
+        best = None
+        for flow in self.flows.values():
+            if self.draining and flow.lane != INTERACTIVE:
+                continue
+            if flow.waiters and not flow.paused and (best is None or (flow.lane, flow.vtime) < (best.lane, best.vtime)):
+                best = flow
+        return best
+
+    async def run(self):
+        self._wakeup = asyncio.Event()
+        self.running = True
+        have_token = False
+        while True:
+            flow = self._next_flow()
+            if flow is None:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            if not have_token:
+                await self.bucket.acquire()
+                have_token = True
+                continue  # pick again: a higher lane may have queued while we waited
+            fut = flow.waiters.popleft()
+            if fut.done():  # the waiter went away; keep the token
+                continue
+            have_token = False
+            self._lane_vtime[flow.lane] = flow.vtime
+            flow.vtime += 1 / flow.weight
+            fut.set_result(None)
 
-async def check_group_has_admins(bot, chat_id) -> bool:
-    try:
-        admins = await bot.get_chat_administrators(chat_id=int(chat_id))
-        return len(admins) > 0
-    except Exception:
-        return False
+    @property
+    def job_count(self) -> int:
+        return sum(1 for f in self.flows.values() if isinstance(f.id, int))
+
+    @property
+    def paused_count(self) -> int:
+        return sum(1 for f in self.flows.values() if isinstance(f.id, int) and f.paused)
+
+scheduler = SendScheduler(global_bucket)
 
-# ---------------- Broadcast logic ----------------
-async def broadcast_message_to_all(msg: Message, context: ContextTypes.DEFAULT_TYPE):
-    row_id = create_message_row(msg)
-    rows = list_chats_db()
-    group_ids = [r[0] for r in rows if r[1] in ("group", "supergroup")]
-    total = len(group_ids)
-    sent = 0
-    failed = 0
-    for gid in group_ids:
+# True inside tasks whose API calls already hold a scheduler grant (broadcast jobs,
+# background refreshes), so SchedulerRateLimiter lets them through untouched.
+_scheduled_sends = ContextVar("scheduled_sends", default=False)
+
+class SchedulerRateLimiter(BaseRateLimiter):
+    """PTB rate limiter that puts the bot's own calls (replies to commands, webhook
+    setup, ...) in the interactive lane."""
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        if _scheduled_sends.get() or not scheduler.running:
+            return await callback(*args, **kwargs)
+        await scheduler.acquire(scheduler.interactive)
+        try:
+            return await callback(*args, **kwargs)
+        except RetryAfter as e:
+            FLOOD_WAITS.inc()
+            global_bucket.flood_wait(e.retry_after)
+            raise
+
+async def throttle(chat_id, flow: Flow):
+    await chat_limiter.acquire(chat_id)
+    await scheduler.acquire(flow)
+
+# Delivery error classes
+FLOOD_WAIT = "flood_wait"
+TRANSIENT = "transient"
+PERMANENT = "permanent"
+
+def classify_error(exc: Exception) -> str:
+    if isinstance(exc, RetryAfter):
+        return FLOOD_WAIT
+    if isinstance(exc, BadRequest):
+        return PERMANENT
+    if isinstance(exc, NetworkError):  # includes TimedOut
+        return TRANSIENT
+    if isinstance(exc, TelegramError):  # Forbidden, ChatMigrated, ...
+        return PERMANENT
+    return TRANSIENT  # httpx / OS level failures
+
+DEAD_CHAT_ERRORS = ("chat not found", "group chat was deactivated", "peer_id_invalid", "bot was kicked",
+                    "bot is not a member", "user is deactivated")
+
+def is_dead_chat_error(exc) -> bool:
+    """True for errors meaning the target chat is gone for the bot, as opposed to e.g.
+    missing send rights or a bad message."""
+    if isinstance(exc, Forbidden):
+        return True
+    return isinstance(exc, BadRequest) and any(s in str(exc).lower() for s in DEAD_CHAT_ERRORS)
+
+class DeadChatTracker:
+    """Counts consecutive dead-chat errors per chat. At `threshold` the chat is marked
+    inactive in `chats`, logged to `left_chats` and dropped from the broadcast targets;
+    any successful delivery resets the count."""
+
+    def __init__(self, threshold: int):
+        self.threshold = threshold
+        self._streaks = {}
+
+    def load(self):
+        self._streaks = {r[0]: r[1] for r in db_read("SELECT chat_id, fail_streak FROM chats WHERE active = 1 AND fail_streak > 0")}
+
+    def failure(self, chat_id: int):
+        if self.threshold <= 0:
+            return
+        streak = self._streaks.get(chat_id, 0) + 1
+        if streak < self.threshold:
+            self._streaks[chat_id] = streak
+            _db_writer.submit(_set_fail_streak, chat_id, streak)
+            return
+        self._streaks.pop(chat_id, None)
+        record = chat_registry.deactivate(chat_id)
+        _db_writer.submit(_deactivate_chat, chat_id, record.title if record else "", streak)
+        logger.info("Marked chat %s inactive after %d dead-chat errors", chat_id, streak)
+
+    def success(self, chat_id: int):
+        if self._streaks.pop(chat_id, None):
+            _db_writer.submit(_set_fail_streak, chat_id, 0)
+
+    def forget(self, chat_id: int):
+        self._streaks.pop(chat_id, None)
+
+dead_chats = DeadChatTracker(DEAD_CHAT_THRESHOLD)
+
+def backoff_delay(attempt: int, base: float = 0.5, cap: float = 30.0) -> float:
+    # exponential backoff with full jitter
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+async def deliver(chat_id, method: str, call, flow: Flow):
+    """Run one Bot API call for `chat_id` under the per-chat limiter and a grant for `flow`.
+
+    Returns (None, result) on success, otherwise (error_class, exception). Transient
+    errors are retried here; a flood wait pauses the shared bucket and is handed back
+    to the caller so the target can be requeued.
+    """
+    attempt = 0
+    while True:
+        await throttle(chat_id, flow)
+        started = time.perf_counter()
+        scheduler.in_flight += 1
+        try:
+            result = await call()
+        except Exception as e:
+            scheduler.in_flight -= 1
+            API_LATENCY.observe(time.perf_counter() - started, method=method)
+            kind = classify_error(e)
+            API_REQUESTS.inc(method=method, outcome=kind)
+            if kind == FLOOD_WAIT:
+                FLOOD_WAITS.inc()
+                global_bucket.flood_wait(e.retry_after)
+            elif kind == TRANSIENT and attempt < TRANSIENT_RETRIES:
+                attempt += 1
+                await asyncio.sleep(backoff_delay(attempt))
+                continue
+            return kind, e
+        scheduler.in_flight -= 1
+        API_LATENCY.observe(time.perf_counter() - started, method=method)
+        API_REQUESTS.inc(method=method, outcome="ok")
+        global_bucket.record_success()
+        return None, result
+
+def format_error(kind: str, err) -> str:
+    return f"{kind}: {err}"
+
+# Recorded errors /retry sends again: rate limits, network failures and skips that may no
+# longer apply. Permanent errors (bot removed, chat gone, bad message) would fail again.
+RETRYABLE_ERRORS = (FLOOD_WAIT + ":", TRANSIENT + ":", "cancelled", "no_admins")
+
+def is_retryable_error(error: str) -> bool:
+    return error.startswith(RETRYABLE_ERRORS)
+
+REQUEUE = object()
+
+async def fan_out(targets, send_one, concurrency: int = MAX_CONCURRENT_SENDS):
+    """Run `send_one(target, attempt)` for every target with at most `concurrency` calls in flight.
+
+    If `send_one` returns REQUEUE the target goes to the back of the queue with attempt + 1.
+    BroadcastCancelled stops every worker once its in-flight call has finished.
+    """
+    pending = deque((t, 1) for t in targets)
+
+    async def worker():
+        while pending:
+            target, attempt = pending.popleft()
+            try:
+                result = await send_one(target, attempt)
+            except BroadcastCancelled:
+                pending.clear()
+                return
+            if result is REQUEUE:
+                pending.append((target, attempt + 1))
+
+    await asyncio.gather(*(worker() for _ in range(min(concurrency, len(pending)))))
+
+# ---------------- Broadcast jobs ----------------
+# A broadcast is a `broadcast_jobs` row plus one 'pending' `deliveries` row per target,
+# created in a single transaction; the job id is the messages row id. The dispatcher
+# sends only targets that are still pending, so a job interrupted by a restart resumes
+# where it stopped and (job, target) pairs already recorded are never sent again.
+Job = namedtuple("Job", "id kind from_chat_id message_id text lane")
+
+def _insert_job(conn: sqlite3.Connection, message_values: tuple, job: Job, targets: List[int]) -> int:
+    cur = conn.execute("""INSERT INTO messages
+                   (msg_date, from_user, from_chat_id, message_id, content_type, text_preview, total_target, total_sent, total_failed)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, 0, 0)""", message_values + (len(targets),))
+    row_id = cur.lastrowid
+    conn.execute("""INSERT INTO broadcast_jobs (message_row_id, kind, from_chat_id, message_id, text, lane, state, created_at)
+                    VALUES (?, ?, ?, ?, ?, ?, 'pending', ?)""",
+                 (row_id, job.kind, job.from_chat_id, job.message_id, job.text, job.lane, now_iso()))
+    conn.executemany("INSERT OR IGNORE INTO deliveries (message_row_id, target_chat_id) VALUES (?, ?)",
+                     [(row_id, t) for t in targets])
+    _bump_daily(conn, message_values[0][:10], messages=1)
+    return row_id
+
+def _claim_pending_jobs(conn: sqlite3.Connection) -> List[Job]:
+    rows = conn.execute("""SELECT message_row_id, kind, from_chat_id, message_id, text, lane
+                           FROM broadcast_jobs WHERE state = 'pending' ORDER BY message_row_id""").fetchall()
+    conn.executemany("UPDATE broadcast_jobs SET state = 'running' WHERE message_row_id = ?", [(r[0],) for r in rows])
+    return [Job(*r) for r in rows]
+
+def _requeue_running_jobs(conn: sqlite3.Connection) -> int:
+    return conn.execute("UPDATE broadcast_jobs SET state = 'pending' WHERE state = 'running'").rowcount
+
+def _finish_job(conn: sqlite3.Connection, job_id: int, state: str = "done"):
+    conn.execute("UPDATE broadcast_jobs SET state = ?, finished_at = ? WHERE message_row_id = ?", (state, now_iso(), job_id))
+
+def _complete_job(conn: sqlite3.Connection, job_id: int) -> int:
+    """Marks the job done unless targets of it are still pending; returns how many are."""
+    left = conn.execute("SELECT COUNT(*) FROM deliveries WHERE message_row_id = ? AND status = ?",
+                        (job_id, PENDING)).fetchone()[0]
+    if not left:
+        _finish_job(conn, job_id)
+    return left
+
+def _set_job_state(conn: sqlite3.Connection, job_id: int, state: str, from_states: tuple) -> bool:
+    marks = ", ".join("?" for _ in from_states)
+    return conn.execute(f"UPDATE broadcast_jobs SET state = ? WHERE message_row_id = ? AND state IN ({marks})",
+                        (state, job_id, *from_states)).rowcount > 0
+
+def _cancel_pending(conn: sqlite3.Connection, job_id: int) -> int:
+    """Marks the job's unsent targets skipped ('cancelled') and the job cancelled."""
+    targets = conn.execute("SELECT target_chat_id FROM deliveries WHERE message_row_id = ? AND status = ?",
+                           (job_id, PENDING)).fetchall()
+    _write_deliveries(conn, [(job_id, t, "skipped", "cancelled") for t, in targets])
+    _finish_job(conn, job_id, "cancelled")
+    return len(targets)
+
+def _cancel_queued_job(conn: sqlite3.Connection, job_id: int) -> bool:
+    state = conn.execute("SELECT state FROM broadcast_jobs WHERE message_row_id = ?", (job_id,)).fetchone()
+    if not state or state[0] not in ("pending", "paused"):
+        return False
+    _cancel_pending(conn, job_id)
+    return True
+
+def _reopen_deliveries(conn: sqlite3.Connection, job_id: int, targets: List[int]) -> int:
+    """Moves failed/skipped deliveries of a finished job back to 'pending' and queues the job
+    again, so only those targets are sent. Returns how many were reopened (0 if the job is
+    still running or archived). The job's counters and error tallies drop the reopened
+    outcomes; daily_stats and daily_errors keep them, as they count attempts per day."""
+    row = conn.execute("""SELECT b.state, m.archived_at FROM broadcast_jobs b JOIN messages m ON m.id = b.message_row_id
+                          WHERE b.message_row_id = ?""", (job_id,)).fetchone()
+    if not row or row[0] not in ("done", "cancelled") or row[1]:
+        return 0
+    counts, errors = {FAILED: 0, SKIPPED: 0}, {}
+    for target in targets:
+        found = conn.execute("""SELECT d.status, e.text FROM deliveries d JOIN error_kinds e ON e.id = d.error_kind
+                                WHERE d.message_row_id = ? AND d.target_chat_id = ? AND d.status IN (?, ?)""",
+                             (job_id, target, FAILED, SKIPPED)).fetchone()
+        if not found:
+            continue
+        conn.execute("UPDATE deliveries SET status = ?, error_kind = 0 WHERE message_row_id = ? AND target_chat_id = ?",
+                     (PENDING, job_id, target))
+        counts[found[0]] += 1
+        cls = error_class(found[1])
+        errors[cls] = errors.get(cls, 0) + 1
+    reopened = sum(counts.values())
+    if reopened:
+        conn.execute("UPDATE messages SET total_failed = total_failed - ?, total_skipped = total_skipped - ? WHERE id = ?",
+                     (counts[FAILED], counts[SKIPPED], job_id))
+        conn.executemany("UPDATE message_errors SET count = count - ? WHERE message_row_id = ? AND error_class = ?",
+                         [(n, job_id, cls) for cls, n in errors.items()])
+        conn.execute("DELETE FROM message_errors WHERE message_row_id = ? AND count <= 0", (job_id,))
+        conn.execute("UPDATE broadcast_jobs SET state = 'pending', finished_at = NULL WHERE message_row_id = ?", (job_id,))
+    return reopened
+
+async def enqueue_broadcast(msg: Message, text: Optional[str] = None, lane: int = BULK, album: List[Message] = ()) -> int:
+    """Persist a broadcast of `msg` (or of `text` via send_message, or of the `album` whose
+    first item is `msg`) to every group; returns the job id.
+    `lane` is the scheduler priority: CHANNEL for channel posts, BULK for admin broadcasts."""
+    if album:
+        job = Job(None, "album", str(msg.chat_id), msg.message_id, json.dumps([album_item(m) for m in album]), lane)
+        preview = next((m.caption for m in album if m.caption), "")[:300]
+        content_type = "album"
+    else:
+        await album_collector.flush(msg.chat_id)  # an album posted just before goes first
+        job = Job(None, "text" if text is not None else "copy", str(msg.chat_id), msg.message_id, text, lane)
+        preview = (text if text is not None else (msg.text or (getattr(msg, "caption", "") or "")))[:300]
+        content_type = detect_content_type(msg)
+    message_values = (now_iso(), (msg.from_user.id if msg.from_user else None), str(msg.chat_id), msg.message_id,
+                      content_type, preview)
+    job_id = await adb_write(_insert_job, message_values, job, chat_registry.targets())
+    dispatcher.notify()
+    return job_id
+
+def format_duration(seconds: float) -> str:
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m"
+    return f"{seconds // 60}m{seconds % 60:02d}s" if seconds >= 60 else f"{seconds}s"
+
+class JobProgress:
+    """Live outcome counters of a running broadcast, for progress messages. Counts include
+    outcomes recorded before a restart; the rate only covers this run."""
+
+    def __init__(self):
+        self.total = 0
+        self.counts = {"sent": 0, "failed": 0, "skipped": 0}
+        self.started = time.monotonic()
+        self._done_at_start = 0
+
+    def start(self, total: int, sent: int, failed: int, skipped: int):
+        self.total = total
+        self.counts.update(sent=sent, failed=failed, skipped=skipped)
+        self._done_at_start = self.done
+        self.started = time.monotonic()
+
+    def add(self, status: str):
+        self.counts[status] += 1
+
+    @property
+    def done(self) -> int:
+        return sum(self.counts.values())
+
+    def render(self, job_id: int, paused: bool = False) -> str:
+        remaining = max(0, self.total - self.done)
+        elapsed = time.monotonic() - self.started
+        rate = (self.done - self._done_at_start) / elapsed if elapsed > 0 else 0.0
+        eta = "paused" if paused else (format_duration(remaining / rate) if rate > 0 else "—")
+        c = self.counts
+        return (f"📨 Broadcast #{job_id}: {self.done}/{self.total}\n"
+                f"sent {c['sent']}, failed {c['failed']}, skipped {c['skipped']}, remaining {remaining}\n"
+                f"rate {rate:.1f}/s, ETA {eta}")
+
+async def run_broadcast_job(bot, job: Job, flow: Flow, progress: JobProgress) -> dict:
+    _scheduled_sends.set(True)  # this task's API calls are granted through `flow`
+    started = time.monotonic()
+    progress.start(*await adb_read_one(
+        "SELECT total_target, total_sent, total_failed, total_skipped FROM messages WHERE id = ?", (job.id,)))
+    rows = await adb_read("SELECT target_chat_id FROM deliveries WHERE message_row_id = ? AND status = ?", (job.id, PENDING))
+    job_targets = {r[0] for r in rows}
+    QUEUE_DEPTH.inc(len(rows))
+
+    source_ids = job_source_ids(job.kind, job.message_id, job.text)
+    media = album_media(json.loads(job.text)) if job.kind == "album" else None
+
+    async def send(tid):
+        if job.kind == "text":
+            return await deliver(tid, "send_message", lambda: bot.send_message(chat_id=tid, text=job.text), flow)
+        if job.kind == "album":
+            return await deliver(tid, "send_media_group", lambda: bot.send_media_group(chat_id=tid, media=media), flow)
+        return await safe_copy(bot, job.from_chat_id, job.message_id, tid, flow)
+
+    def record(tid, status, error=None, copies=()):
+        delivery_log.add(job.id, tid, status, error, copies)
+        progress.add(status)
+        DELIVERIES.inc(status=status)
+        QUEUE_DEPTH.inc(-1)
+
+    async def send_one(tid, attempt):
         if CHECK_ADMIN_BEFORE_SEND:
-            ok_admins = await check_group_has_admins(context.bot, gid)
+            ok_admins = admin_presence.get(tid)  # cached after the first attempt, unless that hit a flood wait
+            if ok_admins is None:
+                await scheduler.acquire(flow)
+                try:
+                    ok_admins = await check_group_has_admins(bot, tid)
+                except RetryAfter as e:
+                    if attempt <= MAX_FLOOD_REQUEUES:
+                        return REQUEUE
+                    record(tid, "failed", format_error(FLOOD_WAIT, e))
+                    return
+                if ok_admins is not None:
+                    admin_presence.put(tid, ok_admins)
             if not ok_admins:
-                add_delivery_record(row_id, gid, "skipped", "no_admins")
-                failed += 1
-                await asyncio.sleep(SEND_DELAY)
-                continue
-        ok, err = await safe_copy(context.bot, msg.chat_id, msg.message_id, gid)
-        if ok:
-            add_delivery_record(row_id, gid, "sent", "")
-            sent += 1
+                record(tid, "skipped", "no_admins")
+                return
+        kind, res = await send(tid)
+        if isinstance(res, ChatMigrated):
+            new_tid = res.new_chat_id
+            await migrate_chat(tid, new_tid)
+            if new_tid in job_targets:
+                record(tid, "skipped", f"migrated to {new_tid}")
+                return
+            tid = new_tid
+            kind, res = await send(tid)
+        if kind is None:
+            # copies are mapped so edits of the source post can follow; text broadcasts have no source post
+            sent = res if isinstance(res, tuple) else (res,)
+            record(tid, "sent", copies=zip(source_ids, (m.message_id for m in sent)) if source_ids else ())
+            dead_chats.success(tid)
+        elif kind == FLOOD_WAIT and attempt <= MAX_FLOOD_REQUEUES:
+            return REQUEUE
         else:
-            add_delivery_record(row_id, gid, "failed", str(err))
-            failed += 1
-        await asyncio.sleep(SEND_DELAY)
-    update_message_counts(row_id, total, sent, failed)
-    json_add_message(sent, failed)
-    return {"row_id": row_id, "total": total, "sent": sent, "failed": failed}
-
-# ---------------- Handlers / Commands (Bangla-friendly) ----------------
+            record(tid, "failed", format_error(kind, res))
+            if is_dead_chat_error(res):
+                dead_chats.failure(tid)
+
+    await fan_out([r[0] for r in rows], send_one)
+    elapsed = time.monotonic() - started
+    BROADCAST_DURATION.observe(elapsed)
+    BROADCAST_RATE.set(len(rows) / elapsed if elapsed > 0 else 0)
+    if not await delivery_log.flush():
+        raise RuntimeError(f"outcomes of broadcast {job.id} could not be written; it resumes after a restart")
+    if flow.cancelled:
+        QUEUE_DEPTH.inc(-await adb_write(_cancel_pending, job.id))
+        logger.info("Broadcast %s cancelled", job.id)
+    else:
+        left = await adb_write(_complete_job, job.id)
+        if left:  # stays 'running', so the next start sends what is left
+            raise RuntimeError(f"{left} targets of broadcast {job.id} are still pending; it resumes after a restart")
+    total, sent, failed, skipped = await adb_read_one(
+        "SELECT total_target, total_sent, total_failed, total_skipped FROM messages WHERE id = ?", (job.id,))
+    return {"row_id": job.id, "total": total, "sent": sent, "failed": failed, "skipped": skipped,
+            "cancelled": flow.cancelled}
+
+class BroadcastDispatcher:
+    """Background task that claims pending jobs and runs each one as its own task.
+    Jobs from the same source chat run one after another, so posts arrive in order."""
+
+    def __init__(self):
+        self._wakeup: Optional[asyncio.Event] = None
+        self._active = {}
+        self._waiters = {}
+        self._last_by_source = {}  # from_chat_id -> task of the newest job from that chat
+        self._progress = {}
+
+    async def run(self, bot):
+        self._wakeup = asyncio.Event()
+        resumed = await adb_write(_requeue_running_jobs)
+        if resumed:
+            logger.info("Resuming %d unfinished broadcast job(s)", resumed)
+        while True:
+            self._wakeup.clear()
+            for job in await adb_write(_claim_pending_jobs):
+                flow = scheduler.open(job.id, job.lane)
+                task = spawn(self._run_job(bot, job, flow, self._last_by_source.get(job.from_chat_id)))
+                self._active[job.id] = self._last_by_source[job.from_chat_id] = task
+            await self._wakeup.wait()
+
+    def notify(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _run_job(self, bot, job: Job, flow: Flow, previous: Optional[asyncio.Task] = None):
+        if previous is not None:
+            await asyncio.wait([previous])
+        self._progress[job.id] = progress = JobProgress()
+        try:
+            summary = await run_broadcast_job(bot, job, flow, progress)
+            error = None
+        except Exception as e:
+            logger.exception("Broadcast job %s failed", job.id)
+            summary, error = None, e
+        finally:
+            scheduler.close(flow)
+            self._active.pop(job.id, None)
+            self._progress.pop(job.id, None)
+            if self._last_by_source.get(job.from_chat_id) is asyncio.current_task():
+                del self._last_by_source[job.from_chat_id]
+        for fut in self._waiters.pop(job.id, []):
+            if fut.done():
+                continue
+            if error is None:
+                fut.set_result(summary)
+            else:
+                fut.set_exception(error)
+
+    def watch(self, job_id: int) -> asyncio.Future:
+        """Future for the job's summary; take it right after enqueueing, before the job can finish."""
+        fut = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(job_id, []).append(fut)
+        return fut
+
+    async def wait(self, job_id: int) -> dict:
+        return await self.watch(job_id)
+
+    async def join(self, job_id: int):
+        """Returns once the job's task (if it has one) has finished and flushed its outcomes."""
+        task = self._active.get(job_id)
+        if task is not None:
+            await asyncio.wait([task])
+
+    def progress_text(self, job_id: int) -> Optional[str]:
+        progress = self._progress.get(job_id)
+        if progress is None or not progress.total:
+            return None  # still queued behind another job
+        flow = scheduler.flows.get(job_id)
+        return progress.render(job_id, paused=bool(flow and flow.paused))
+
+    async def pause(self, job_id: int) -> bool:
+        if not await adb_write(_set_job_state, job_id, "paused", ("pending", "running")):
+            return False
+        scheduler.pause(job_id)
+        return True
+
+    async def resume(self, job_id: int) -> bool:
+        # a job paused before a restart has no flow any more and goes back to the queue
+        if scheduler.resume(job_id):
+            return await adb_write(_set_job_state, job_id, "running", ("paused",))
+        if await adb_write(_set_job_state, job_id, "pending", ("paused",)):
+            self.notify()
+            return True
+        return False
+
+    async def cancel(self, job_id: int) -> bool:
+        if scheduler.cancel(job_id):
+            return True  # run_broadcast_job skips the rest once in-flight sends finish
+        if not await adb_write(_cancel_queued_job, job_id):
+            return False
+        for fut in self._waiters.pop(job_id, []):
+            if not fut.done():
+                fut.set_exception(BroadcastCancelled(job_id))
+        return True
+
+    @property
+    def active_count(self) -> int:
+        return len(self._active)
+
+dispatcher = BroadcastDispatcher()
+
+# Broadcast logic
+async def broadcast_message_to_all(msg: Message, context: ContextTypes.DEFAULT_TYPE, text: Optional[str] = None):
+    job_id = await enqueue_broadcast(msg, text)
+    return await dispatcher.wait(job_id)
+
+async def report_progress(status_msg: Message, job_id: int, done: asyncio.Future):
+    """Edits `status_msg` in place while the job runs: at most once per PROGRESS_EDIT_INTERVAL,
+    only when the numbers changed, and a last time with the summary."""
+    started = time.monotonic()
+    last_text = status_msg.text
+    while not done.done():
+        await asyncio.wait([done], timeout=PROGRESS_EDIT_INTERVAL)
+        text = None if done.done() else dispatcher.progress_text(job_id)
+        if text and text != last_text:
+            try:
+                await status_msg.edit_text(text)
+                last_text = text
+            except TelegramError as e:
+                logger.debug("Progress edit for broadcast %s failed: %s", job_id, e)
+    try:
+        summary = done.result()
+        outcome = "cancelled" if summary["cancelled"] else "completed"
+        text = (f"Broadcast #{job_id} {outcome} in {format_duration(time.monotonic() - started)}. "
+                f"sent: {summary['sent']}, failed: {summary['failed']}, skipped: {summary['skipped']}")
+    except BroadcastCancelled:
+        text = f"Broadcast #{job_id} cancelled before it started."
+    except Exception as e:
+        text = f"Broadcast #{job_id} failed: {e}"
+    try:
+        await status_msg.edit_text(text)
+    except TelegramError as e:
+        logger.error("Could not report broadcast %s: %s", job_id, e)
+
+async def start_broadcast(msg: Message, text: Optional[str] = None, album: List[Message] = ()) -> int:
+    """Queues the broadcast and acks the admin with the job id right away; the ack is then
+    kept up to date as a progress message, so the handler never waits for the fan-out."""
+    job_id = await enqueue_broadcast(msg, text, album=album)
+    done = dispatcher.watch(job_id)
+    status_msg = await msg.reply_text(f"📨 Broadcast #{job_id} queued for {chat_registry.target_count} groups.")
+    spawn(report_progress(status_msg, job_id, done))
+    return job_id
+
+# ---------------- Edit propagation ----------------
+# message_map records where every copied post landed. Edits of a source post are replayed
+# on each copy, and /delete removes them, one API call per group through the scheduler.
+# The Bot API sends no update when a message is deleted, so deletion is an admin command.
+_copy_updates = {}  # (source chat, source message) -> (flow, asyncio.Event set once it stopped)
+
+def _mapped_copies(source_chat_id: int, source_message_id: int) -> list:
+    return db_read("""SELECT target_chat_id, target_message_id FROM message_map
+                      WHERE source_chat_id = ? AND source_message_id = ?""", (source_chat_id, source_message_id))
+
+def _forget_copies(conn: sqlite3.Connection, source_chat_id: int, source_message_id: int, targets: List[int]):
+    conn.executemany("DELETE FROM message_map WHERE source_chat_id = ? AND source_message_id = ? AND target_chat_id = ?",
+                     [(source_chat_id, source_message_id, t) for t in targets])
+
+# BadRequests that mean the copy already is in the requested state
+_NOOP_ERRORS = ("message is not modified", "message to delete not found")
+
+async def propagate_to_copies(source_chat_id: int, source_message_id: int, method: str, make_call, lane: int) -> dict:
+    """Runs `make_call(target_chat_id, target_message_id)` for every copy of the source post.
+
+    A newer call for the same post supersedes one still running: the old one is cancelled
+    and finishes its in-flight requests first. Returns outcome counts.
+    """
+    key = (source_chat_id, source_message_id)
+    while key in _copy_updates:
+        old_flow, stopped = _copy_updates[key]
+        scheduler.cancel(old_flow.id)
+        await stopped.wait()
+    flow, stopped = scheduler.open((method,) + key, lane), asyncio.Event()
+    _copy_updates[key] = (flow, stopped)
+    outcomes = {"ok": 0, "failed": 0}
+    done_targets = []
+    # only for these calls: the caller's own replies afterwards go through the rate limiter again
+    scheduled = _scheduled_sends.set(True)
+    try:
+        await delivery_log.flush()  # copies recorded so far but still buffered
+        copies = dict(await run_blocking(_mapped_copies, *key))
+
+        async def send_one(tid, attempt):
+            kind, res = await deliver(tid, method, lambda: make_call(tid, copies[tid]), flow)
+            if kind is None or any(s in str(res).lower() for s in _NOOP_ERRORS):
+                outcomes["ok"] += 1
+                done_targets.append(tid)
+            elif kind == FLOOD_WAIT and attempt <= MAX_FLOOD_REQUEUES:
+                return REQUEUE
+            else:
+                outcomes["failed"] += 1
+                logger.info("%s of %s:%s in %s failed: %s", method, source_chat_id, source_message_id, tid, res)
+
+        await fan_out(list(copies), send_one)
+        if method == "delete_message" and done_targets:
+            await adb_write(_forget_copies, source_chat_id, source_message_id, done_targets)
+    finally:
+        _scheduled_sends.reset(scheduled)
+        scheduler.close(flow)
+        del _copy_updates[key]
+        stopped.set()
+    outcomes["cancelled"] = flow.cancelled
+    return outcomes
+
+async def mirror_edit(bot, msg: Message, lane: int) -> dict:
+    if msg.text is not None:
+        return await propagate_to_copies(msg.chat_id, msg.message_id, "edit_message_text", lambda chat_id, message_id:
+                                         bot.edit_message_text(msg.text, chat_id=chat_id, message_id=message_id,
+                                                               entities=msg.entities), lane)
+    # media posts: only the caption can be mirrored (edit_message_media would need a re-upload)
+    return await propagate_to_copies(msg.chat_id, msg.message_id, "edit_message_caption", lambda chat_id, message_id:
+                                     bot.edit_message_caption(chat_id=chat_id, message_id=message_id, caption=msg.caption,
+                                                              caption_entities=msg.caption_entities), lane)
+
+async def delete_copies(bot, source_chat_id: int, source_message_id: int) -> dict:
+    return await propagate_to_copies(source_chat_id, source_message_id, "delete_message", lambda chat_id, message_id:
+                                     bot.delete_message(chat_id=chat_id, message_id=message_id), CHANNEL)
+
+# ---------------- Retention ----------------
+# Delivery rows are only needed while a broadcast runs and for a while after for /deliveries;
+# the aggregates keep the numbers. Old rows go to gzip JSONL files, one per broadcast in a
+# folder per day, and the freed pages are returned to the filesystem in small steps.
+def _archivable_jobs(cutoff: str) -> list:
+    return db_read("""SELECT m.id, substr(m.msg_date, 1, 10) FROM messages m
+                      LEFT JOIN broadcast_jobs j ON j.message_row_id = m.id
+                      WHERE m.msg_date < ? AND m.archived_at IS NULL AND COALESCE(j.state, 'done') IN ('done', 'cancelled')
+                      ORDER BY m.id""", (cutoff,))
+
+def write_delivery_archive(day: str, job_id: int) -> str:
+    folder = os.path.join(ARCHIVE_DIR, day)
+    path = os.path.join(folder, f"deliveries-{job_id}.jsonl.gz")
+    if os.path.exists(path):
+        return path  # written by a pass that stopped before deleting the rows
+    os.makedirs(folder, exist_ok=True)
+    rows = db_read("""SELECT d.target_chat_id, d.status, e.text FROM deliveries d JOIN error_kinds e ON e.id = d.error_kind
+                      WHERE d.message_row_id = ?""", (job_id,))
+    with gzip.open(path + ".tmp", "wt", encoding="utf-8") as f:
+        for target, status, error in rows:
+            f.write(json.dumps({"message_row_id": job_id, "target_chat_id": target, "status": DELIVERY_STATUSES[status],
+                                "error": error},
+                               ensure_ascii=False) + "\n")
+    os.replace(path + ".tmp", path)
+    return path
+
+def _delete_deliveries_chunk(conn: sqlite3.Connection, job_id: int, limit: int) -> int:
+    return conn.execute("""DELETE FROM deliveries WHERE message_row_id = ? AND target_chat_id IN
+                           (SELECT target_chat_id FROM deliveries WHERE message_row_id = ? LIMIT ?)""",
+                        (job_id, job_id, limit)).rowcount
+
+def _mark_archived(conn: sqlite3.Connection, job_id: int):
+    conn.execute("UPDATE messages SET archived_at = ? WHERE id = ?", (now_iso(), job_id))
+    # edits of posts this old are no longer mirrored
+    row = conn.execute("SELECT from_chat_id, kind, message_id, text FROM broadcast_jobs WHERE message_row_id = ?",
+                       (job_id,)).fetchone()
+    if row:
+        conn.executemany("DELETE FROM message_map WHERE source_chat_id = ? AND source_message_id = ?",
+                         [(int(row[0]), source_id) for source_id in job_source_ids(*row[1:])])
+
+def _incremental_vacuum(conn: sqlite3.Connection, pages: int) -> int:
+    # executescript steps the pragma to completion; execute() stops after the first page or so
+    conn.executescript(f"PRAGMA incremental_vacuum({int(pages)})")
+    return conn.execute("PRAGMA freelist_count").fetchone()[0]
+
+async def apply_retention(retention_days: int = DELIVERY_RETENTION_DAYS, chunk: int = 5000) -> int:
+    """Archives and deletes delivery rows of finished broadcasts older than `retention_days`,
+    then vacuums; returns the number of rows moved out."""
+    cutoff = (datetime.utcnow() - timedelta(days=retention_days)).strftime("%Y-%m-%d")
+    moved = 0
+    for job_id, day in await run_blocking(_archivable_jobs, cutoff):
+        path = await run_blocking(write_delivery_archive, day, job_id)
+        # deleted in chunks so the writer keeps serving live broadcasts in between
+        while (deleted := await adb_write(_delete_deliveries_chunk, job_id, chunk)):
+            moved += deleted
+            ARCHIVED_DELIVERIES.inc(deleted)
+        await adb_write(_mark_archived, job_id)
+        logger.info("Archived deliveries of broadcast %s to %s", job_id, path)
+    free_pages = None
+    while True:
+        remaining = await adb_write(_incremental_vacuum, VACUUM_STEP_PAGES)
+        if not remaining or remaining == free_pages:  # done, or auto_vacuum is off
+            break
+        free_pages = remaining
+        await asyncio.sleep(0.1)
+    return moved
+
+async def run_retention():
+    while True:
+        try:
+            moved = await apply_retention()
+            if moved:
+                logger.info("Retention moved %s delivery rows to %s", moved, ARCHIVE_DIR)
+        except Exception as e:
+            logger.error("Retention pass failed: %s", e)
+        await asyncio.sleep(RETENTION_INTERVAL)
+
+# ---------------- Event loop lag monitor ----------------
+class LoopLagMonitor:
+    """Measures how late a periodic sleep wakes up; anything above a few ms means
+    something blocked the event loop."""
+
+    def __init__(self, interval: float = 0.5, warn_after: float = 0.1):
+        self.interval = interval
+        self.warn_after = warn_after
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - started - self.interval)
+            self.last_lag = lag
+            self.max_lag = max(self.max_lag, lag)
+            if lag > self.warn_after:
+                logger.warning("Event loop blocked for %.0f ms", lag * 1000)
+
+loop_monitor = LoopLagMonitor()
+Gauge("event_loop_lag_seconds", "Most recent event loop lag sample", lambda: loop_monitor.last_lag)
+Gauge("send_rate_limit", "Current adaptive global send rate (msg/s)", lambda: global_bucket.rate)
+_background_tasks = set()
+
+def spawn(coro) -> asyncio.Task:
+    # keep a reference so the task isn't garbage collected mid-flight
+    task = asyncio.get_running_loop().create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+async def on_startup(app):
+    spawn(loop_monitor.run())
+    spawn(scheduler.run())
+    spawn(dispatcher.run(app.bot))
+    if CHECK_ADMIN_BEFORE_SEND:
+        spawn(admin_presence.run(app.bot))
+    if DELIVERY_RETENTION_DAYS > 0:
+        spawn(run_retention())
+    start_web_server(app)
+
+async def on_stop(app):
+    # runs while the bot can still make calls: sends that already went out get their
+    # outcome written, everything not yet granted stays pending for the next start
+    await scheduler.drain(SHUTDOWN_DRAIN_SECONDS)
+    await delivery_log.flush()
+
+async def on_shutdown(app):
+    await delivery_log.flush()
+
+# ---------------- Handlers / Commands ----------------
 async def start_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text("🤖 বট অন আছে — অ্যাডমিনরা /help বা /সহায়তা কমান্ড দেখতে পারেন।")
+    await update.message.reply_text(
+        "🤖 Full Forward Bot running.\n"
+        "Admins can use:\n"
+        "/help\n/addadmin <id>\n/removeadmin <id>\n/listadmins\n/groups\n/status\n/report <YYYY-MM-DD> [YYYY-MM-DD]\n/broadcast <text>\n/pause <job>\n/resume <job>\n/cancel <job>\n/retry <job>\n/delete <job>\n/export\n\n"
+        "Add bot to groups/channels and it will auto-register. Channel posts forwarded to groups only."
+    )
 
 async def help_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not is_admin(update.effective_user.id):
@@ -322,114 +2073,25 @@ async def help_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     text = (
         "🛠️ কমান্ড (অ্যাডমিনদের জন্য):\n"
         "/start - বট স্ট্যাটাস\n"
-        "/সহায়তা বা /help - কমান্ড তালিকা\n"
+        "/help - কমান্ড তালিকা\n"
         "/addadmin <id> - নতুন অ্যাডমিন\n"
         "/removeadmin <id> - অ্যাডমিন রিমুভ\n"
         "/listadmins - অ্যাডমিন তালিকা\n"
         "/groups - গ্রুপ তালিকা\n"
-        "/অবস্থা - বট স্ট্যাটাস\n"
-        "/report <YYYY-MM-DD> - ওই দিনের রিপোর্ট\n"
+        "/status - বট স্ট্যাটাস\n"
+        "/report <YYYY-MM-DD> [YYYY-MM-DD] - ওই দিনের (বা সময়সীমার) রিপোর্ট\n"
         "/broadcast <text> - সব গ্রুপে পাঠাও\n"
-        ".বার্তা <text> - (ব্যানলা শর্ট কমান্ড) সব গ্রুপে পাঠাও\n"
+        ".বার্তা <text> - (বাংলা শর্ট কমান্ড) সব গ্রুপে পাঠাও\n"
+        "/deliveries <job> - একটি ব্রডকাস্টের ডেলিভারি\n"
+        "/pause <job> - ব্রডকাস্ট থামাও\n"
+        "/resume <job> - থামানো ব্রডকাস্ট আবার চালাও\n"
+        "/cancel <job> - ব্রডকাস্ট বাতিল\n"
+        "/retry <job> - ব্যর্থ গ্রুপগুলোতে আবার পাঠাও\n"
+        "/delete <job> - গ্রুপগুলো থেকে কপি মুছে ফেলো\n"
+        "/export - data.json এক্সপোর্ট\n"
     )
     await update.message.reply_text(text)
 
-async def addadmin_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not is_admin(update.effective_user.id):
-        return await update.message.reply_text("⛔ অনুমতি নেই।")
-    if not context.args:
-        return await update.message.reply_text("ব্যবহার: /addadmin <telegram_user_id>")
-    try:
-        uid = int(context.args[0])
-    except Exception:
-        return await update.message.reply_text("user_id সংখ্যায় হতে হবে।")
-    ok = add_admin_db(uid)
-    if ok:
-        await update.message.reply_text(f"✅ অ্যাডমিন যোগ করা হলো: {uid}")
-    else:
-        await update.message.reply_text("⚠️ আগেই আছে।")
-
-async def removeadmin_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not is_admin(update.effective_user.id):
-        return await update.message.reply_text("⛔ অনুমতি নেই।")
-    if not context.args:
-        return await update.message.reply_text("ব্যবহার: /removeadmin <telegram_user_id>")
-    try:
-        uid = int(context.args[0])
-    except Exception:
-        return await update.message.reply_text("user_id সংখ্যায় হতে হবে।")
-    ok = remove_admin_db(uid)
-    if ok:
-        await update.message.reply_text(f"🗑️ অ্যাডমিন সরানো হলো: {uid}")
-    else:
-        await update.message.reply_text("অ্যাডমিন পাওয়া যায়নি।")
-
-async def listadmins_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not is_admin(update.effective_user.id):
-        return await update.message.reply_text("⛔ অনুমতি নেই।")
-    admins = list_admins_db()
-    await update.message.reply_text("অ্যাডমিনস:\n" + "\n".join(str(a) for a in admins))
-
-async def groups_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not is_admin(update.effective_user.id):
-        return await update.message.reply_text("⛔ অনুমতি নেই।")
-    rows = list_chats_db()
-    if not rows:
-        return await update.message.reply_text("কোনো গ্রুপ রেজিস্টার নেই।")
-    lines = []
-    for chat_id, ctype, title, username, added_by, added_at in rows:
-        label = title or chat_id
-        if username:
-            label += f" (@{username})"
-        lines.append(f"- [{ctype}] {label} — {chat_id} — যোগ: {added_at[:10]}")
-    await update.message.reply_text("📋 গ্রুপ তালিকা:\n" + "\n".join(lines))
-
-async def status_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not is_admin(update.effective_user.id):
-        return await update.message.reply_text("⛔ অনুমতি নেই।")
-    rows = list_chats_db()
-    admins = list_admins_db()
-    await update.message.reply_text(f"🔎 অবস্থা:\nঅ্যাডমিনস: {len(admins)}\nমোট গ্রুপ: {len(rows)}\nSEND_DELAY: {SEND_DELAY}s")
-
-async def report_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not is_admin(update.effective_user.id):
-        return await update.message.reply_text("⛔ অনুমতি নেই।")
-    if not context.args:
-        return await update.message.reply_text("ব্যবহার: /report YYYY-MM-DD")
-    qdate = context.args[0]
-    try:
-        datetime.strptime(qdate, "%Y-%m-%d")
-    except Exception:
-        return await update.message.reply_text("তারিখ ফরম্যাট ভুল — YYYY-MM-DD")
-    ensure_json()
-    with open(JSON_PATH, "r", encoding="utf-8") as f:
-        d = json.load(f)
-    groups_added = d.get("groups_added_by_date", {}).get(qdate, [])
-    messages = d.get("messages_by_date", {}).get(qdate, {"sent":0,"failed":0})
-    text = f"রিপোর্ট {qdate}:\nগ্রুপ যোগ: {len(groups_added)}\nমেসেজ পাঠানো: {messages.get('sent',0)}\nফেইল: {messages.get('failed',0)}"
-    await update.message.reply_text(text)
-
-async def broadcast_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not is_admin(update.effective_user.id):
-        return await update.message.reply_text("⛔ অনুমতি নেই।")
-    if not context.args:
-        return await update.message.reply_text("ব্যবহার: /broadcast <text>")
-    text = " ".join(context.args)
-    rows = list_chats_db()
-    group_ids = [r[0] for r in rows if r[1] in ("group","supergroup")]
-    sent = 0
-    failed = 0
-    for gid in group_ids:
-        try:
-            await context.bot.send_message(chat_id=int(gid), text=text)
-            sent += 1
-        except Exception as e:
-            failed += 1
-            logger.warning("Broadcast failed to %s: %s", gid, e)
-        await asyncio.sleep(SEND_DELAY)
-    json_add_message(sent, failed)
-    await update.message.reply_text(f"ব্রডকাস্ট সম্পন্ন — পাঠানো: {sent}, ব্যর্থ: {failed}")
-
 async def bangla_barta_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # handler for messages starting with .বার্তা
     user = update.effective_user
@@ -439,197 +2101,7 @@ async def bangla_barta_handler(update: Update, context: ContextTypes.DEFAULT_TYP
     parts = text.split(" ",1)
     if len(parts)<2 or not parts[1].strip():
         return await update.message.reply_text("ব্যবহার: .বার্তা <মেসেজ>")
-    summary = await broadcast_message_to_all(update.message, context)
-    await update.message.reply_text(f"প্রেরণ: পাঠানো={summary['sent']} ব্যর্থ={summary['failed']}")
-
-async def private_message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    # private messages from admin -> broadcast
-    user = update.effective_user
-    if not user or not is_admin(user.id):
-        return
-    summary = await broadcast_message_to_all(update.message, context)
-    await update.message.reply_text(f"প্রেরণ: পাঠানো={summary['sent']} ব্যর্থ={summary['failed']}")
-
-async def channel_post_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    # channel posts forwarded only to registered groups
-    msg = update.channel_post
-    if not msg:
-        return
-    summary = await broadcast_message_to_all(msg, context)
-    # optionally notify MAIN_ADMIN
-    try:
-        await context.bot.send_message(chat_id=MAIN_ADMIN_ID, text=f"Channel post forwarded: sent={summary['sent']} failed={summary['failed']}")
-    except Exception:
-        pass
-
-def extract_status_change(old: ChatMember, new: ChatMember) -> Optional[tuple]:
-    try:
-        old_status = old.status
-        new_status = new.status
-        if old_status == new_status:
-            return None
-        return old_status, new_status
-    except Exception:
-        return None
-
-async def my_chat_member_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    chat = update.effective_chat
-    if not chat:
-        return
-    old = update.my_chat_member.old_chat_member
-    new = update.my_chat_member.new_chat_member
-    status_change = extract_status_change(old, new)
-    if not status_change:
-        return
-    old_status, new_status = status_change
-    cid = str(chat.id)
-    ctype = chat.type
-    title = chat.title or ""
-    username = getattr(chat, "username", "") or ""
-    if new_status in ("member","administrator","creator"):
-        added = add_chat_db(cid, ctype, title, username, None)
-        if added:
-            logger.info("Registered chat %s (%s)", title or cid, ctype)
-            json_add_group(cid, title)
-    elif new_status in ("left","kicked","banned"):
-        removed = remove_chat_db(cid)
-        if removed:
-            log_left_chat(cid, title)
-            json_log_left(cid, title)
-            logger.info("Removed chat %s because bot left/kicked", cid)
-
-async def deliveries_for_message_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not is_admin(update.effective_user.id):
-        return await update.message.reply_text("⛔ অনুমতি নেই।")
-    if not context.args:
-        return await update.message.reply_text("ব্যবহার: /deliveries <message_r    except sqlite3.IntegrityError:
-        return False
-    finally:
-        conn.close()
-
-def remove_chat_db(chat_id: str) -> bool:
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("DELETE FROM chats WHERE chat_id = ?", (str(chat_id),))
-    changed = cur.rowcount
-    conn.commit()
-    conn.close()
-    return changed > 0
-
-def list_chats_db():
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("SELECT chat_id, type, title, username, added_by, added_at FROM chats ORDER BY added_at DESC")
-    rows = cur.fetchall()
-    conn.close()
-    return rows
-
-def log_left_chat(chat_id: str, title: str):
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("INSERT OR REPLACE INTO left_chats (chat_id, title, removed_at) VALUES (?, ?, ?)",
-                (str(chat_id), title or "", now_iso()))
-    conn.commit()
-    conn.close()
-
-# Message & delivery logging
-def create_message_row(msg: Message) -> int:
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    content_type = detect_content_type(msg)
-    preview = (msg.text or (getattr(msg, "caption", "") or ""))[:300]
-    cur.execute("""INSERT INTO messages 
-                   (msg_date, from_user, from_chat_id, message_id, content_type, text_preview, total_target, total_sent, total_failed)
-                   VALUES (?, ?, ?, ?, ?, ?, 0, 0, 0)""",
-                (now_iso(), (msg.from_user.id if msg.from_user else None), str(msg.chat_id), msg.message_id, content_type, preview))
-    row_id = cur.lastrowid
-    conn.commit()
-    conn.close()
-    return row_id
-
-def update_message_counts(row_id: int, target_total: int, sent: int, failed: int):
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("UPDATE messages SET total_target=?, total_sent=?, total_failed=? WHERE id=?",
-                (target_total, sent, failed, row_id))
-    conn.commit()
-    conn.close()
-
-def add_delivery_record(message_row_id: int, target_chat_id: str, status: str, error: Optional[str] = None):
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("INSERT INTO deliveries (message_row_id, target_chat_id, status, error) VALUES (?, ?, ?, ?)",
-                (message_row_id, str(target_chat_id), status, error or ""))
-    conn.commit()
-    conn.close()
-
-# Utilities
-def detect_content_type(msg: Message) -> str:
-    if msg.text:
-        return "text"
-    if msg.photo:
-        return "photo"
-    if msg.video:
-        return "video"
-    if msg.document:
-        return "document"
-    if msg.audio:
-        return "audio"
-    if msg.voice:
-        return "voice"
-    if msg.sticker:
-        return "sticker"
-    return "other"
-
-async def safe_copy(bot, from_chat_id, message_id, to_chat_id):
-    try:
-        await bot.copy_message(chat_id=int(to_chat_id), from_chat_id=int(from_chat_id), message_id=int(message_id))
-        return True, None
-    except Exception as e:
-        return False, str(e)
-
-async def check_group_has_admins(bot, chat_id) -> bool:
-    try:
-        admins = await bot.get_chat_administrators(chat_id=int(chat_id))
-        return len(admins) > 0
-    except Exception:
-        return False
-
-# Broadcast logic
-async def broadcast_message_to_all(msg: Message, context: ContextTypes.DEFAULT_TYPE):
-    row_id = create_message_row(msg)
-    targets = list_chats_db()
-    target_ids = [r[0] for r in targets if r[1] in ("group", "supergroup")]
-    total = len(target_ids)
-    sent = 0
-    failed = 0
-    for tid in target_ids:
-        if CHECK_ADMIN_BEFORE_SEND:
-            ok_admins = await check_group_has_admins(context.bot, tid)
-            if not ok_admins:
-                add_delivery_record(row_id, tid, "skipped", "no_admins")
-                failed += 1
-                await asyncio.sleep(SEND_DELAY)
-                continue
-        ok, err = await safe_copy(context.bot, msg.chat_id, msg.message_id, tid)
-        if ok:
-            add_delivery_record(row_id, tid, "sent", None)
-            sent += 1
-        else:
-            add_delivery_record(row_id, tid, "failed", str(err))
-            failed += 1
-        await asyncio.sleep(SEND_DELAY)
-    update_message_counts(row_id, total, sent, failed)
-    return {"row_id": row_id, "total": total, "sent": sent, "failed": failed}
-
-# ---------------- Handlers / Commands ----------------
-async def start_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text(
-        "🤖 Full Forward Bot running.\n"
-        "Admins can use:\n"
-        "/addadmin <id>\n/removeadmin <id>\n/listadmins\n/groups\n/status\n/report <YYYY-MM-DD>\n/broadcast <text>\n\n"
-        "Add bot to groups/channels and it will auto-register. Channel posts forwarded to groups only."
-    )
+    await start_broadcast(update.message, parts[1].strip())
 
 async def addadmin_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     caller = update.effective_user
@@ -644,7 +2116,7 @@ async def addadmin_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except ValueError:
         await update.message.reply_text("user_id must be number.")
         return
-    ok = add_admin_db(uid)
+    ok = await run_blocking(add_admin_db, uid)
     if ok:
         await update.message.reply_text(f"✅ Admin {uid} added.")
     else:
@@ -663,7 +2135,7 @@ async def removeadmin_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except ValueError:
         await update.message.reply_text("user_id must be number.")
         return
-    ok = remove_admin_db(uid)
+    ok = await run_blocking(remove_admin_db, uid)
     if ok:
         await update.message.reply_text(f"🗑️ Admin {uid} removed.")
     else:
@@ -674,7 +2146,7 @@ async def listadmins_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not caller or not is_admin(caller.id):
         await update.message.reply_text("❌ Permission denied.")
         return
-    admins = list_admins_db()
+    admins = await run_blocking(list_admins_db)
     await update.message.reply_text("Admins:\n" + "\n".join(str(a) for a in admins))
 
 async def groups_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -682,16 +2154,18 @@ async def groups_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not caller or not is_admin(caller.id):
         await update.message.reply_text("❌ Permission denied.")
         return
-    rows = list_chats_db()
+    rows = chat_registry.rows()
     if not rows:
         await update.message.reply_text("No chats registered.")
         return
     lines = []
-    for chat_id, ctype, title, username, added_by, added_at in rows:
-        label = title or chat_id
-        if username:
-            label += f" (@{username})"
-        lines.append(f"- [{ctype}] {label} — {chat_id} — added: {added_at}")
+    for r in rows:
+        label = r.title or str(r.chat_id)
+        if r.username:
+            label += f" (@{r.username})"
+        if not r.active:
+            label += " [inactive]"
+        lines.append(f"- [{r.type}] {label} — {r.chat_id} — added: {r.added_at}")
     await update.message.reply_text("Registered chats:\n" + "\n".join(lines))
 
 async def details_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -702,45 +2176,77 @@ async def status_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not caller or not is_admin(caller.id):
         await update.message.reply_text("❌ Permission denied.")
         return
-    total_chats = len(list_chats_db())
-    admins = list_admins_db()
     await update.message.reply_text(
-        f"Status:\nAdmins: {len(admins)}\nRegistered chats: {total_chats}\nSEND_DELAY: {SEND_DELAY}s\nCHECK_ADMIN_BEFORE_SEND: {CHECK_ADMIN_BEFORE_SEND}"
+        f"Status:\nAdmins: {len(admin_cache)}\nRegistered chats: {len(chat_registry)} (groups: {chat_registry.target_count}, inactive: {chat_registry.inactive_count})\nActive broadcasts: {dispatcher.active_count} (paused: {scheduler.paused_count})\nRate limit: {GLOBAL_RATE_LIMIT}/s, concurrency: {MAX_CONCURRENT_SENDS}\nCHECK_ADMIN_BEFORE_SEND: {CHECK_ADMIN_BEFORE_SEND}\n"
+        f"Loop lag: last {loop_monitor.last_lag * 1000:.0f} ms, max {loop_monitor.max_lag * 1000:.0f} ms"
     )
 
 def query_messages_by_date(query_date: str):
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
     start_iso = f"{query_date}T00:00:00"
     end_iso = f"{query_date}T23:59:59"
-    cur.execute("""SELECT id, msg_date, content_type, text_preview, total_target, total_sent, total_failed
-                   FROM messages WHERE msg_date BETWEEN ? AND ? ORDER BY id DESC""", (start_iso, end_iso))
-    rows = cur.fetchall()
-    conn.close()
-    return rows
+    return db_read("""SELECT id, msg_date, content_type, text_preview, total_target, total_sent, total_failed, total_skipped
+                   FROM messages WHERE msg_date BETWEEN ? AND ? ORDER BY msg_date DESC, id DESC""", (start_iso, end_iso))
+
+def query_daily_report(start_day: str, end_day: str):
+    """Per-day totals and the most common error classes for a day range, read from the aggregates."""
+    days = db_read("""SELECT day, messages, sent, failed, skipped, groups_added, groups_left
+                      FROM daily_stats WHERE day BETWEEN ? AND ? ORDER BY day""", (start_day, end_day))
+    errors = db_read("""SELECT error_class, SUM(count) FROM daily_errors WHERE day BETWEEN ? AND ?
+                        GROUP BY error_class ORDER BY 2 DESC LIMIT 5""", (start_day, end_day))
+    return days, errors
+
+def format_daily_report(start_day: str, end_day: str, days, errors) -> str:
+    title = f"Report {start_day}" if start_day == end_day else f"Report {start_day} → {end_day}"
+    lines = [title]
+    totals = [0] * 6
+    for day, *counts in days:
+        totals = [t + (c or 0) for t, c in zip(totals, counts)]
+        if start_day != end_day:
+            lines.append(f"{day}: messages {counts[0]}, sent {counts[1]}, failed {counts[2]}, skipped {counts[3]}, "
+                         f"groups +{counts[4]}/-{counts[5]}")
+    lines.append(f"Total: messages {totals[0]}, sent {totals[1]}, failed {totals[2]}, skipped {totals[3]}, "
+                 f"groups +{totals[4]}/-{totals[5]}")
+    if errors:
+        lines.append("Top errors:")
+        lines.extend(f"  {n} × {cls}" for cls, n in errors)
+    return "\n".join(lines)
 
 async def report_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     caller = update.effective_user
     if not caller or not is_admin(caller.id):
         await update.message.reply_text("❌ Permission denied.")
         return
-    if not context.args:
-        await update.message.reply_text("Usage: /report YYYY-MM-DD")
+    if not context.args or len(context.args) > 2:
+        await update.message.reply_text("Usage: /report YYYY-MM-DD [YYYY-MM-DD]")
         return
-    qdate = context.args[0]
+    start_day, end_day = context.args[0], context.args[-1]
     try:
-        _ = datetime.strptime(qdate, "%Y-%m-%d")
+        if datetime.strptime(start_day, "%Y-%m-%d") > datetime.strptime(end_day, "%Y-%m-%d"):
+            start_day, end_day = end_day, start_day
     except Exception:
         await update.message.reply_text("Invalid date format. Use YYYY-MM-DD")
         return
-    rows = query_messages_by_date(qdate)
-    if not rows:
-        await update.message.reply_text("No messages on that date.")
+    days, errors = await run_blocking(query_daily_report, start_day, end_day)
+    if not days:
+        await update.message.reply_text("No activity in that range." if start_day != end_day else "No messages on that date.")
         return
-    lines = []
-    for r in rows:
-        lines.append(f"ID:{r[0]} {r[1][:19]} {r[2]} sent:{r[5]} failed:{r[6]} targets:{r[4]}\nPreview: {r[3]}")
-    await update.message.reply_text("\n\n".join(lines))
+    text = format_daily_report(start_day, end_day, days, errors)
+    if start_day == end_day:
+        rows = await run_blocking(query_messages_by_date, start_day)
+        lines = [text]
+        for r in rows:
+            lines.append(f"ID:{r[0]} {r[1][:19]} {r[2]} sent:{r[5]} failed:{r[6]} skipped:{r[7]} targets:{r[4]}\nPreview: {r[3]}")
+        text = "\n\n".join(lines)
+    await update.message.reply_text(text)
+
+async def export_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    caller = update.effective_user
+    if not caller or not is_admin(caller.id):
+        await update.message.reply_text("❌ Permission denied.")
+        return
+    data = await run_blocking(export_legacy_json)
+    payload = json.dumps(data, indent=2, ensure_ascii=False).encode("utf-8")
+    await update.message.reply_document(document=io.BytesIO(payload), filename=os.path.basename(JSON_PATH))
 
 async def broadcast_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     caller = update.effective_user
@@ -750,21 +2256,31 @@ async def broadcast_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not context.args:
         await update.message.reply_text("Usage: /broadcast <text>")
         return
-    text = " ".join(context.args)
-    rows = list_chats_db()
-    group_ids = [r[0] for r in rows if r[1] in ("group", "supergroup")]
-    total = len(group_ids)
-    sent = 0
-    failed = 0
-    for gid in group_ids:
-        try:
-            await context.bot.send_message(chat_id=int(gid), text=text)
-            sent += 1
-        except Exception as e:
-            failed += 1
-            logger.warning("Broadcast failed to %s: %s", gid, e)
-        await asyncio.sleep(SEND_DELAY)
-    await update.message.reply_text(f"Broadcast done — sent: {sent}, failed: {failed}")
+    await start_broadcast(update.message, " ".join(context.args))
+
+async def _job_command(update: Update, context: ContextTypes.DEFAULT_TYPE, command: str, action, done: str):
+    caller = update.effective_user
+    if not caller or not is_admin(caller.id):
+        await update.message.reply_text("❌ Permission denied.")
+        return
+    try:
+        job_id = int(context.args[0])
+    except (IndexError, ValueError):
+        await update.message.reply_text(f"Usage: /{command} <job id>")
+        return
+    if await action(job_id):
+        await update.message.reply_text(f"Broadcast #{job_id} {done}.")
+    else:
+        await update.message.reply_text(f"Broadcast #{job_id} can't be {done} in its current state.")
+
+async def pause_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await _job_command(update, context, "pause", dispatcher.pause, "paused")
+
+async def resume_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await _job_command(update, context, "resume", dispatcher.resume, "resumed")
+
+async def cancel_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await _job_command(update, context, "cancel", dispatcher.cancel, "cancelled")
 
 async def private_message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
@@ -773,14 +2289,79 @@ async def private_message_handler(update: Update, context: ContextTypes.DEFAULT_
     msg = update.message
     if not msg:
         return
-    summary = await broadcast_message_to_all(msg, context)
-    await update.message.reply_text(f"Broadcast completed. sent: {summary['sent']}, failed: {summary['failed']}")
+    if msg.media_group_id:
+        album_collector.add(msg, lambda album: start_broadcast(album[0], album=album))
+        return
+    await start_broadcast(msg)
 
 async def channel_post_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     msg = update.channel_post
     if not msg:
         return
-    await broadcast_message_to_all(msg, context)
+    if msg.media_group_id:
+        album_collector.add(msg, lambda album: enqueue_broadcast(album[0], lane=CHANNEL, album=album))
+        return
+    await enqueue_broadcast(msg, lane=CHANNEL)
+
+async def edited_post_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # channel post edits, and edits of admins' private messages that were broadcast
+    msg = update.edited_channel_post or update.edited_message
+    if not msg:
+        return
+    if update.edited_message and (not update.effective_user or not is_admin(update.effective_user.id)):
+        return
+    spawn(mirror_edit(context.bot, msg, CHANNEL if update.edited_channel_post else BULK))
+
+async def retry_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    caller = update.effective_user
+    if not caller or not is_admin(caller.id):
+        await update.message.reply_text("❌ Permission denied.")
+        return
+    try:
+        job_id = int(context.args[0])
+    except (IndexError, ValueError):
+        await update.message.reply_text("Usage: /retry <job id>")
+        return
+    rows = await adb_read("""SELECT d.target_chat_id, e.text FROM deliveries d JOIN error_kinds e ON e.id = d.error_kind
+                             WHERE d.message_row_id = ? AND d.status IN (?, ?)""", (job_id, FAILED, SKIPPED))
+    active = set(chat_registry.targets())
+    targets = [t for t, error in rows if t in active and is_retryable_error(error)]
+    if not targets:
+        await update.message.reply_text(f"Nothing to retry in broadcast #{job_id}.")
+        return
+    reopened = await adb_write(_reopen_deliveries, job_id, targets)
+    if not reopened:
+        await update.message.reply_text(f"Broadcast #{job_id} is still running or already archived.")
+        return
+    done = dispatcher.watch(job_id)
+    dispatcher.notify()
+    status_msg = await update.message.reply_text(f"🔁 Broadcast #{job_id}: retrying {reopened} of {len(rows)} failed deliveries.")
+    spawn(report_progress(status_msg, job_id, done))
+
+async def _report_delete(msg: Message, job_id: int, source_chat_id: int, source_ids: List[int]):
+    await dispatcher.join(job_id)  # sends in flight when it was cancelled still make copies
+    outcomes = [await delete_copies(msg.get_bot(), source_chat_id, source_id) for source_id in source_ids]
+    ok, failed = sum(o["ok"] for o in outcomes), sum(o["failed"] for o in outcomes)
+    await msg.reply_text(f"Broadcast #{job_id}: deleted {ok} copies, {failed} failed.")
+
+async def delete_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    caller = update.effective_user
+    if not caller or not is_admin(caller.id):
+        await update.message.reply_text("❌ Permission denied.")
+        return
+    try:
+        job_id = int(context.args[0])
+    except (IndexError, ValueError):
+        await update.message.reply_text("Usage: /delete <job id>")
+        return
+    row = await adb_read_one("""SELECT from_chat_id, kind, message_id, text FROM broadcast_jobs
+                                WHERE message_row_id = ? AND kind IN ('copy', 'album')""", (job_id,))
+    if not row:
+        await update.message.reply_text("No copied broadcast with that id.")
+        return
+    await dispatcher.cancel(job_id)  # stop sending copies we're about to delete
+    spawn(_report_delete(update.message, job_id, int(row[0]), job_source_ids(*row[1:])))
+    await update.message.reply_text(f"Deleting the copies of broadcast #{job_id}…")
 
 # Chat member updates
 def extract_status_change(old: ChatMember, new: ChatMember) -> Optional[tuple]:
@@ -803,20 +2384,40 @@ async def my_chat_member_update(update: Update, context: ContextTypes.DEFAULT_TY
     if not status_change:
         return
     old_status, new_status = status_change
-    cid = str(chat.id)
+    cid = chat.id
+    admin_presence.invalidate(cid)
     ctype = chat.type
     title = chat.title or ""
     username = getattr(chat, "username", "") or ""
     if new_status in ("member", "administrator", "creator"):
-        added = add_chat_db(cid, ctype, title, username, None)
+        added = await run_blocking(add_chat_db, cid, ctype, title, username, None)
         if added:
             logger.info("Registered chat %s (%s)", title or cid, ctype)
     elif new_status in ("left", "kicked", "banned"):
-        removed = remove_chat_db(cid)
+        removed = await run_blocking(remove_chat_db, cid)
         if removed:
-            log_left_chat(cid, title)
+            await run_blocking(log_left_chat, cid, title)
             logger.info("Removed chat %s because bot left/kicked", cid)
 
+async def migration_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    msg = update.effective_message
+    if not msg:
+        return
+    if msg.migrate_to_chat_id:
+        await migrate_chat(msg.chat_id, msg.migrate_to_chat_id)
+    elif msg.migrate_from_chat_id:
+        await migrate_chat(msg.migrate_from_chat_id, msg.chat_id)
+
+async def chat_member_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # someone else's membership changed; only admin promotions/demotions matter to the cache
+    chat = update.effective_chat
+    change = update.chat_member
+    if not chat or not change:
+        return
+    admin_statuses = ("administrator", "creator")
+    if change.old_chat_member.status in admin_statuses or change.new_chat_member.status in admin_statuses:
+        admin_presence.invalidate(chat.id)
+
 async def deliveries_for_message_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     caller = update.effective_user
     if not caller or not is_admin(caller.id):
@@ -830,28 +2431,66 @@ async def deliveries_for_message_cmd(update: Update, context: ContextTypes.DEFAU
     except ValueError:
         await update.message.reply_text("invalid id")
         return
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("SELECT target_chat_id, status, error FROM deliveries WHERE message_row_id = ?", (mid,))
-    rows = cur.fetchall()
-    conn.close()
-    if not rows:
+    totals = await adb_read_one("""SELECT total_target, total_sent, total_failed, total_skipped, archived_at
+                                   FROM messages WHERE id = ?""", (mid,))
+    if not totals:
         await update.message.reply_text("No deliveries found for that id.")
         return
-    ok = sum(1 for r in rows if r[1] == "sent")
-    failed = sum(1 for r in rows if r[1] == "failed")
-    skipped = sum(1 for r in rows if r[1] == "skipped")
-    text = f"Deliveries for {mid}: sent={ok}, failed={failed}, skipped={skipped}\n\n"
-    sample = "\n".join([f"{r[0]} — {r[1]} — {r[2][:150]}" for r in rows[:200]])
-    await update.message.reply_text(text + sample)
+    total, ok, failed, skipped, archived_at = totals
+    errors = await adb_read("""SELECT error_class, count FROM message_errors WHERE message_row_id = ?
+                               ORDER BY count DESC LIMIT 5""", (mid,))
+    rows = await adb_read("""SELECT d.target_chat_id, d.status, e.text FROM deliveries d
+                             JOIN error_kinds e ON e.id = d.error_kind
+                             WHERE d.message_row_id = ? AND d.status IN (?, ?) LIMIT 50""", (mid, FAILED, SKIPPED))
+    text = f"Deliveries for {mid}: sent={ok}, failed={failed}, skipped={skipped}, pending={total - ok - failed - skipped}\n"
+    if archived_at:
+        text += f"Per-target rows archived {archived_at[:10]}.\n"
+    if errors:
+        text += "Top errors:\n" + "\n".join(f"  {n} × {cls}" for cls, n in errors) + "\n"
+    sample = "\n".join([f"{r[0]} — {DELIVERY_STATUSES[r[1]]} — {r[2][:150]}" for r in rows])
+    await update.message.reply_text(text + "\n" + sample if sample else text)
 
 # ----------------- Main -----------------
-def main():
-    init_db()
-    app = ApplicationBuilder().token(BOT_TOKEN).build()
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """Runs up to `max_concurrent_updates` updates concurrently, except that updates
+    from the same chat are processed one at a time in arrival order."""
+
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates)
+        self._chat_locks = {}  # chat_id -> [lock, updates holding or waiting for it]
+
+    async def do_process_update(self, update, coroutine):
+        chat = update.effective_chat if isinstance(update, Update) else None
+        if chat is None:
+            await coroutine
+            return
+        # asyncio.Lock wakes waiters FIFO, which keeps a chat's updates in arrival order
+        entry = self._chat_locks.setdefault(chat.id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                await coroutine
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._chat_locks[chat.id]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+ALLOWED_UPDATES = ["message", "edited_message", "channel_post", "edited_channel_post", "my_chat_member", "chat_member"]
+
+def build_application() -> Application:
+    app = (ApplicationBuilder().token(BOT_TOKEN).rate_limiter(SchedulerRateLimiter())
+           .concurrent_updates(ChatOrderedUpdateProcessor(MAX_CONCURRENT_UPDATES))
+           .post_init(on_startup).post_stop(on_stop).post_shutdown(on_shutdown).build())
 
     # commands
     app.add_handler(CommandHandler("start", start_cmd))
+    app.add_handler(CommandHandler("help", help_cmd))
     app.add_handler(CommandHandler("addadmin", addadmin_cmd))
     app.add_handler(CommandHandler("removeadmin", removeadmin_cmd))
     app.add_handler(CommandHandler("listadmins", listadmins_cmd))
@@ -861,40 +2500,112 @@ def main():
     app.add_handler(CommandHandler("report", report_cmd))
     app.add_handler(CommandHandler("broadcast", broadcast_cmd))
     app.add_handler(CommandHandler("deliveries", deliveries_for_message_cmd))
+    app.add_handler(CommandHandler("pause", pause_cmd))
+    app.add_handler(CommandHandler("resume", resume_cmd))
+    app.add_handler(CommandHandler("cancel", cancel_cmd))
+    app.add_handler(CommandHandler("retry", retry_cmd))
+    app.add_handler(CommandHandler("delete", delete_cmd))
+    app.add_handler(CommandHandler("export", export_cmd))
 
     # chat member updates
     app.add_handler(ChatMemberHandler(my_chat_member_update, chat_member_types=ChatMemberHandler.MY_CHAT_MEMBER))
+    app.add_handler(ChatMemberHandler(chat_member_update, chat_member_types=ChatMemberHandler.CHAT_MEMBER))
+
+    # group -> supergroup upgrades
+    app.add_handler(MessageHandler(filters.StatusUpdate.MIGRATE, migration_handler))
 
     # channel posts
-    app.add_handler(MessageHandler(filters.CHAT_TYPE_CHANNEL & ~filters.COMMAND, channel_post_handler))
+    app.add_handler(MessageHandler(filters.UpdateType.CHANNEL_POST & ~filters.COMMAND, channel_post_handler))
 
     # private admin messages -> broadcast
-    app.add_handler(MessageHandler(filters.ChatType.PRIVATE & (~filters.COMMAND), private_message_handler))
-
-    logger.info("Bot started — polling for updates...")
-    app.run_polling(allowed_updates=[
-        "message", "edited_message", "channel_post", "my_chat_member", "chat_member"
-    ])
-
-# ---------------- KEEP-ALIVE (Flask) ----------------
-from flask import Flask
-from threading import Thread
-
-web_app = Flask("")
-
-@web_app.route("/")
-def home():
-    return "Full Forward Bot is alive!"
-
-def run_web():
-    web_app.run(host="0.0.0.0", port=8080)
+    # .বার্তা <text> goes before the private handler, which would otherwise copy the whole message
+    app.add_handler(MessageHandler(filters.UpdateType.MESSAGE & filters.Regex(r"^\.বার্তা(\s|$)"), bangla_barta_handler))
+    app.add_handler(MessageHandler(filters.UpdateType.MESSAGE & filters.ChatType.PRIVATE & (~filters.COMMAND),
+                                   private_message_handler))
+
+    # edits of broadcast sources -> edit the copies
+    app.add_handler(MessageHandler(filters.UpdateType.EDITED_CHANNEL_POST | (filters.UpdateType.EDITED_MESSAGE & filters.ChatType.PRIVATE),
+                                   edited_post_handler))
+
+    return app
+
+async def serve_webhook(app: Application):
+    # mirrors Application.run_polling's lifecycle, minus the updater
+    await app.initialize()
+    await on_startup(app)
+    if WEBHOOK_URL:
+        await app.bot.set_webhook(url=WEBHOOK_URL + WEBHOOK_PATH, allowed_updates=ALLOWED_UPDATES,
+                                  secret_token=WEBHOOK_SECRET or None)
+    await app.start()
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    logger.info("Bot started — webhook on :%s%s", PORT, WEBHOOK_PATH)
+    try:
+        await stop.wait()
+    finally:
+        await on_stop(app)
+        await app.stop()
+        await app.shutdown()
+        await on_shutdown(app)
+
+def resolve_webhook_secret():
+    # the handler trusts update JSON (admin ids included), so never serve it unauthenticated by accident
+    global WEBHOOK_SECRET
+    if WEBHOOK_SECRET or WEBHOOK_INSECURE:
+        return
+    if not WEBHOOK_URL:
+        raise SystemExit("BOT_MODE=webhook needs WEBHOOK_SECRET, or WEBHOOK_URL so one can be generated "
+                         "(WEBHOOK_INSECURE=1 skips the check, for local testing only)")
+    WEBHOOK_SECRET = secrets.token_urlsafe(32)
 
-def keep_alive():
-    t = Thread(target=run_web)
-    t.daemon = True
-    t.start()
+def main():
+    if BOT_MODE == "webhook":
+        resolve_webhook_secret()
+    init_db()
+    app = build_application()
+    if BOT_MODE == "webhook":
+        asyncio.run(serve_webhook(app))
+    else:
+        logger.info("Bot started — polling for updates...")
+        app.run_polling(allowed_updates=ALLOWED_UPDATES)
+
+# ---------------- Web server (health check + webhook) ----------------
+# Runs on the bot's own asyncio loop. To exercise webhook mode locally:
+#   BOT_MODE=webhook WEBHOOK_INSECURE=1 python main.py
+#   curl -X POST localhost:8080/telegram -H 'Content-Type: application/json' -d @update.json
+class HealthHandler(RequestHandler):
+    def get(self):
+        self.write("Full Forward Bot is alive!")
+
+class MetricsHandler(RequestHandler):
+    def get(self):
+        self.set_header("Content-Type", "text/plain; version=0.0.4")
+        self.write(render_metrics())
+
+class WebhookHandler(RequestHandler):
+    def initialize(self, app: Application):
+        self.app = app
+
+    async def post(self):
+        token = self.request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+        if not (hmac.compare_digest(token.encode(), WEBHOOK_SECRET.encode()) if WEBHOOK_SECRET else WEBHOOK_INSECURE):
+            self.set_status(403)
+            return
+        try:
+            data = json.loads(self.request.body)
+        except ValueError:
+            self.set_status(400)
+            return
+        await self.app.update_queue.put(Update.de_json(data, self.app.bot))
+
+def start_web_server(app: Application):
+    routes = [(r"/", HealthHandler), (r"/metrics", MetricsHandler)]
+    if BOT_MODE == "webhook":
+        routes.append((WEBHOOK_PATH, WebhookHandler, {"app": app}))
+    WebApplication(routes).listen(PORT)
 
 # Start
 if __name__ == "__main__":
-    keep_alive()
     main()